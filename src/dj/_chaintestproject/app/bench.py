@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2012 by Łukasz Langa
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""End-to-end benchmarks of common chain operations on generated data.
+
+Every operation is measured for SQL queries issued, rows fetched from the
+database, values yielded by the chain and wall time. Query counts are
+checked against ``QUERY_BUDGETS`` so that regressions in pushing work down
+to the database are caught early."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import random
+from timeit import default_timer
+
+from django.db import connections
+import six
+
+from dj.chain import chain
+from dj.chain.paginator import ChainPaginator
+from dj._chaintestproject.app.models import Review, Song, Video
+
+
+# maximum number of SQL queries per operation on a chain of two QuerySets
+QUERY_BUDGETS = {
+    'count': 2,
+    'exists': 2,
+    'page': 4,
+    'top-n': 2,
+    'export': 2,
+}
+
+
+def _create(model, objects, using, batch_size):
+    manager = model.objects.using(using)
+    if hasattr(manager, 'bulk_create'):
+        manager.bulk_create(objects, batch_size=batch_size)
+    else:
+        # Django < 1.4
+        for obj in objects:
+            obj.save(using=using)
+
+
+def populate(rows, using='default', batch_size=1000):
+    """Creates ``rows`` videos and songs and a review for every tenth
+    of them, filling all models of the test project."""
+    rng = random.Random(rows)
+    videos = [Video(title='Video {}'.format(i), author='Author {}'.format(i),
+                    duration=rng.randint(1, 3600),
+                    resolution=rng.randint(1, 5))
+              for i in six.moves.range(rows)]
+    songs = [Song(title='Song {}'.format(i), artist='Artist {}'.format(i),
+                  duration=rng.randint(1, 600), genre=rng.randint(1, 5))
+             for i in six.moves.range(rows)]
+    _create(Video, videos, using, batch_size)
+    _create(Song, songs, using, batch_size)
+    reviews = [Review(video=video, text='Review')
+               for video in Video.objects.using(using)[::10]]
+    reviews.extend(Review(song=song, text='Review')
+                   for song in Song.objects.using(using)[::10])
+    _create(Review, reviews, using, batch_size)
+
+
+def media(using='default'):
+    return chain(Video.objects.using(using).all(),
+                 Song.objects.using(using).all())
+
+
+def count(c):
+    c.count()
+    return 1
+
+
+def exists(c):
+    c.exists()
+    return 1
+
+
+def page(c):
+    paginator = ChainPaginator(c, 20)
+    return len(paginator.page(max(paginator.num_pages // 2, 1)))
+
+
+def top_n(c):
+    return len([value for value in c.order_by('-duration')[:10]])
+
+
+def export(c):
+    return c.export(six.StringIO(), ('title', 'duration'))
+
+
+OPERATIONS = (
+    ('count', count),
+    ('exists', exists),
+    ('page', page),
+    ('top-n', top_n),
+    ('export', export),
+)
+
+
+class captured_queries(object):
+    """Captures queries run on the given database, like Django 1.6+
+    ``CaptureQueriesContext`` which is used where available. Indexing and
+    ``len()`` work on the captured queries after the block."""
+
+    def __init__(self, using='default'):
+        self.connection = connections[using]
+        self.count = 0
+        self.captured = []
+
+    def __enter__(self):
+        try:
+            from django.test.utils import CaptureQueriesContext
+        except ImportError:
+            self.context = None
+            self.debug_cursor = self.connection.use_debug_cursor
+            self.connection.use_debug_cursor = True
+            self.start = len(self.connection.queries)
+        else:
+            self.context = CaptureQueriesContext(self.connection)
+            self.context.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.context is not None:
+            self.context.__exit__(*exc_info)
+            self.captured = self.context.captured_queries
+        else:
+            self.connection.use_debug_cursor = self.debug_cursor
+            self.captured = self.connection.queries[self.start:]
+        self.count = len(self.captured)
+
+    def __len__(self):
+        return len(self.captured)
+
+    def __getitem__(self, index):
+        return self.captured[index]
+
+
+class fetched_rows(object):
+    """Counts rows fetched by queries on the given database. Requires
+    Django 2.0+ for ``execute_wrapper``, ``count`` is ``None`` on older
+    versions."""
+
+    def __init__(self, using='default'):
+        self.connection = connections[using]
+        self.wrapper = None
+        self.count = None
+
+    def __enter__(self):
+        if hasattr(self.connection, 'execute_wrapper'):
+            self.count = 0
+            self.wrapper = self.connection.execute_wrapper(self)
+            self.wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.wrapper is not None:
+            return self.wrapper.__exit__(*exc_info)
+
+    def __call__(self, execute, sql, params, many, context):
+        result = execute(sql, params, many, context)
+        cursor = context['cursor']
+        cursor.fetchone = self._counted(cursor.cursor.fetchone, single=True)
+        cursor.fetchmany = self._counted(cursor.cursor.fetchmany)
+        cursor.fetchall = self._counted(cursor.cursor.fetchall)
+        return result
+
+    def _counted(self, fetch, single=False):
+        def wrapper(*args, **kwargs):
+            rows = fetch(*args, **kwargs)
+            if single:
+                self.count += rows is not None
+            else:
+                self.count += len(rows)
+            return rows
+        return wrapper
+
+
+def measure(operation, using='default'):
+    """Runs ``operation`` on a fresh chain and returns its statistics."""
+    c = media(using)
+    with captured_queries(using) as queries:
+        with fetched_rows(using) as fetched:
+            start = default_timer()
+            yielded = operation(c)
+            elapsed = default_timer() - start
+    return {
+        'queries': queries.count,
+        'fetched': fetched.count,
+        'yielded': yielded,
+        'seconds': elapsed,
+    }
+
+
+def run(using='default', budgets=QUERY_BUDGETS):
+    """Measures all ``OPERATIONS``. Returns a list of ``(name, stats,
+    over_budget)`` tuples."""
+    results = []
+    for name, operation in OPERATIONS:
+        stats = measure(operation, using)
+        budget = budgets.get(name)
+        results.append((name, stats,
+                        budget is not None and stats['queries'] > budget))
+    return results
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2012 by Łukasz Langa
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import django
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from dj._chaintestproject.app import bench
+from dj._chaintestproject.app.models import Review, Song, Video
+
+
+OPTIONS = (
+    (('--rows',), dict(type=int, default=10000,
+                       help='videos and songs to generate (default: '
+                            '10000)')),
+    (('--database',), dict(default='bench',
+                           help='database alias to use (default: bench)')),
+    (('--keep',), dict(action='store_true', default=False,
+                       help='reuse existing data instead of regenerating '
+                            'it')),
+)
+
+
+def _optparse_options():
+    from optparse import make_option
+    options = []
+    for args, kwargs in OPTIONS:
+        if kwargs.get('type') is int:
+            kwargs = dict(kwargs, type='int')
+        options.append(make_option(*args, **kwargs))
+    return tuple(options)
+
+
+class Command(BaseCommand):
+    help = ("Generates data and measures queries, fetched rows and time of "
+            "common chain operations. Fails if an operation exceeds its "
+            "query budget.")
+
+    if django.VERSION < (1, 8):
+        # optparse, replaced by add_arguments
+        option_list = BaseCommand.option_list + _optparse_options()
+
+    def add_arguments(self, parser):
+        for args, kwargs in OPTIONS:
+            parser.add_argument(*args, **kwargs)
+
+    def handle(self, *args, **options):
+        using = options['database']
+        rows = options['rows']
+        if django.VERSION < (1, 7):
+            call_command('syncdb', database=using, verbosity=0,
+                         interactive=False)
+        elif django.VERSION < (1, 9):
+            # apps without migrations are synced implicitly
+            call_command('migrate', database=using, verbosity=0,
+                         interactive=False)
+        else:
+            call_command('migrate', database=using, run_syncdb=True,
+                         verbosity=0, interactive=False)
+        if not options['keep'] or not Video.objects.using(using).exists():
+            for model in (Review, Video, Song):
+                model.objects.using(using).all().delete()
+            bench.populate(rows, using)
+        results = bench.run(using)
+        self.stdout.write('{:<8} {:>8} {:>8} {:>8} {:>10}'.format(
+            'op', 'queries', 'fetched', 'yielded', 'ms',
+        ))
+        failed = []
+        for name, stats, over_budget in results:
+            self.stdout.write('{:<8} {:>8} {:>8} {:>8} {:>10.1f}{}'.format(
+                name, stats['queries'],
+                '-' if stats['fetched'] is None else stats['fetched'],
+                stats['yielded'],
+                stats['seconds'] * 1000,
+                ' OVER BUDGET ({})'.format(bench.QUERY_BUDGETS[name])
+                if over_budget else '',
+            ))
+            if over_budget:
+                failed.append(name)
+        if failed:
+            raise CommandError('Query budget exceeded: {}'.format(
+                ', '.join(failed),
+            ))
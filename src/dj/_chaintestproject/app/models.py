@@ -38,6 +38,7 @@ class Titled(db.Model):
 
 class Dynamic(db.Model):
     duration = db.PositiveIntegerField()
+    released = db.DateField(null=True, blank=True)
 
     class Meta:
         abstract = True
@@ -51,6 +52,7 @@ class Video(Titled, Dynamic):
 
     author = db.CharField(max_length=100)
     resolution = db.IntegerField(choices=RESOLUTION)
+    uploaded = db.DateTimeField(null=True, blank=True)
 
     def __unicode__(self):
         return "{} - {} ({} s at {})".format(
@@ -70,3 +72,11 @@ class Song(Titled, Dynamic):
         return "{} - {} ({} s; {})".format(
                 self.artist, self.title, self.duration,
                 self.get_genre_display())
+
+
+class Review(db.Model):
+    video = db.ForeignKey(Video, null=True, blank=True,
+                          related_name='reviews', on_delete=db.CASCADE)
+    song = db.ForeignKey(Song, null=True, blank=True,
+                         related_name='reviews', on_delete=db.CASCADE)
+    text = db.TextField()
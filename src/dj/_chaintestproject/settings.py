@@ -147,6 +147,24 @@ BASE_PATH = os.path.realpath(os.path.join(os.path.dirname(__file__), '..'))
 TEST_DISCOVERY_ROOT = os.path.realpath(os.path.dirname(dj.chain.__file__))
 TEST_RUNNER = "dj._chaintestproject.DiscoveryDjangoTestSuiteRunner"
 
+# File-backed shards so that tests can query them from multiple threads
+import tempfile
+for shard in ('shard1', 'shard2'):
+    shard_path = os.path.join(tempfile.gettempdir(),
+                              'dj_chain_test_{}.db'.format(shard))
+    DATABASES[shard] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': shard_path,
+        'TEST_NAME': shard_path,
+        'TEST': {'NAME': shard_path},
+    }
+
+# File-backed database for the chainbench management command
+DATABASES['bench'] = {
+    'ENGINE': 'django.db.backends.sqlite3',
+    'NAME': os.path.join(tempfile.gettempdir(), 'dj_chain_bench.db'),
+}
+
 import django
 if django.VERSION[:2] < (1, 4):
     del LOGGING['filters']['require_debug_false']
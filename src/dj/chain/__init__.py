@@ -32,18 +32,672 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
-from django.core.exceptions import FieldError
+from collections import deque
+import datetime
+from functools import partial
+import heapq
+import itertools
+from itertools import compress, islice
+import os
+import sys
+
 from null import unset
 
 import six
 
+if sys.version_info >= (3, 6):
+    # async generators are a syntax error on older Pythons
+    from dj.chain.aio import AsyncChainMixin
+else:
+    AsyncChainMixin = object
+
+
+class _plan(object):
+    """Immutable state of a chain. Derived chains share their plan with
+    the original until one of its attributes is replaced, in which case only
+    the top-level object is rebuilt and all unchanged tuples are reused.
+
+    ``history`` is a persistent linked list of collective calls made on the
+    chain, stored as ``(parent, method, args, kwargs, pushed)`` tuples where
+    ``pushed`` tells for each iterable whether the call was applied to it."""
+
+    __slots__ = ('iterables', 'start', 'stop', 'step', 'strict', 'xsort',
+                 'xvalues_mode', 'xvalues_fields', 'xprefetch', 'xparallel',
+                 'xthreads', 'xqueue', 'xbounds', 'xstats', 'history')
+
+    def __init__(self, iterables=(), start=None, stop=None, step=None,
+                 strict=False, xsort=(), xvalues_mode=None,
+                 xvalues_fields=(), xprefetch=(), xparallel=None,
+                 xthreads=None, xqueue=None, xbounds=(), xstats=None,
+                 history=None):
+        self.iterables = tuple(iterables)
+        self.start = start
+        self.stop = stop
+        self.step = step
+        self.strict = strict
+        self.xsort = tuple(xsort)
+        self.xvalues_mode = xvalues_mode
+        self.xvalues_fields = tuple(xvalues_fields)
+        self.xprefetch = tuple(xprefetch)
+        self.xparallel = xparallel
+        self.xthreads = xthreads
+        self.xqueue = xqueue
+        self.xbounds = tuple(xbounds)
+        self.xstats = xstats
+        self.history = history
+
+    def replace(self, **changes):
+        result = _plan.__new__(_plan)
+        for name in _plan.__slots__:
+            setattr(result, name, getattr(self, name))
+        for name, value in changes.items():
+            if name in ('iterables', 'xsort', 'xvalues_fields', 'xprefetch',
+                        'xbounds'):
+                value = tuple(value)
+            setattr(result, name, value)
+        return result
+
+    def calls(self):
+        """Returns the collective calls made, oldest first."""
+        result = []
+        node = self.history
+        while node is not None:
+            result.append(node[1:])
+            node = node[0]
+        result.reverse()
+        return result
+
+
+class _planned(object):
+    """Exposes a plan attribute on the chain. Assignment replaces the plan
+    of the given chain instead of mutating it, so copies stay independent."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        return getattr(instance._plan, self.name)
+
+    def __set__(self, instance, value):
+        instance._plan = instance._plan.replace(**{self.name: value})
+
+
+class _ordering_key(object):
+    """Compares by ``key`` first, then by ``values`` where each one can be
+    reversed."""
+
+    __slots__ = ('key', 'values', 'reverse')
+
+    def __init__(self, key, values, reverse):
+        self.key = key
+        self.values = values
+        self.reverse = reverse
+
+    def __lt__(self, other):
+        if self.key != other.key:
+            return self.key < other.key
+        for a, b, reverse in zip(self.values, other.values, self.reverse):
+            if a != b:
+                return b < a if reverse else a < b
+        return False
+
+    def __eq__(self, other):
+        # lets heap entries fall back to the position of the iterable
+        return not (self < other or other < self)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+
+class _spool(object):
+    """A re-iterable wrapper for a one-shot iterator. Values are pulled from
+    the iterator lazily and the first ``threshold`` of them are kept in
+    memory. Further values are only stored when they will be needed again:
+    when ``len()`` pulls them or when another iteration over the spool is
+    in progress. They are then pickled to a temporary file, or kept in
+    memory if they can't be pickled. Otherwise a single pass over a long
+    iterator stores nothing past the threshold and iterating over the spool
+    again raises ``ValueError``."""
+
+    def __init__(self, iterator, threshold):
+        self.iterator = iterator
+        self.threshold = threshold
+        self.memory = []
+        self.file = None
+        self.spilled = 0
+        # values which couldn't be pickled, stored after the spilled ones
+        self.overflow = []
+        self.pulled = 0
+        self.passes = 0
+        self.dropped = False
+
+    def _pull(self, keep=False):
+        """Returns the next value from the iterator, stored unless it's past
+        the threshold and ``keep`` is ``False``. Raises ``StopIteration`` if
+        the iterator is exhausted."""
+        if self.iterator is None:
+            raise StopIteration
+        try:
+            value = six.next(self.iterator)
+        except StopIteration:
+            self.iterator = None
+            raise
+        self.pulled += 1
+        if len(self.memory) < self.threshold:
+            self.memory.append(value)
+        elif not keep:
+            self.dropped = True
+        elif self.overflow or not self._spill(value):
+            self.overflow.append(value)
+        return value
+
+    def _spill(self, value):
+        """Pickles ``value`` to the temporary file. Returns ``False`` if it
+        can't be pickled."""
+        # imported here since spilling to disk is rare
+        import tempfile
+        from six.moves import cPickle as pickle
+        if self.file is None:
+            self.file = tempfile.TemporaryFile()
+        self.file.seek(0, os.SEEK_END)
+        end = self.file.tell()
+        try:
+            pickle.dump(value, self.file, pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            # pickling errors vary: lambdas, local classes, open files...
+            self.file.seek(end)
+            self.file.truncate()
+            return False
+        self.spilled += 1
+        return True
+
+    def _check(self):
+        """Raises ``ValueError`` if values were dropped."""
+        if self.dropped:
+            raise ValueError(
+                "A one-shot iterator was consumed past spool_threshold "
+                "values in a single pass, it can't be iterated over again. "
+                "Call len() on the chain first or raise spool_threshold.",
+            )
+
+    def __iter__(self):
+        self._check()
+        self.passes += 1
+        try:
+            index = 0
+            offset = 0
+            while True:
+                stored = len(self.memory) + self.spilled
+                if index < len(self.memory):
+                    value = self.memory[index]
+                elif index < stored:
+                    from six.moves import cPickle as pickle
+                    self.file.seek(offset)
+                    value = pickle.load(self.file)
+                    offset = self.file.tell()
+                elif index < stored + len(self.overflow):
+                    value = self.overflow[index - stored]
+                elif index < self.pulled:
+                    # another pass dropped the value
+                    self._check()
+                elif self.iterator is None:
+                    break
+                else:
+                    try:
+                        value = self._pull(keep=self.passes > 1)
+                    except StopIteration:
+                        break
+                yield value
+                index += 1
+        finally:
+            self.passes -= 1
+
+    def __len__(self):
+        self._check()
+        while self.iterator is not None:
+            try:
+                self._pull(keep=True)
+            except StopIteration:
+                pass
+        return len(self.memory) + self.spilled + len(self.overflow)
+
+
+def _xform_batch(xform, values):
+    """Module-level so that it can be pickled for process pools."""
+    return [xform(value) for value in values]
+
+
+def _slice_iterable(iterable, start, stop):
+    """Returns values of ``iterable`` between ``start`` and ``stop``. Lists,
+    tuples, strings and QuerySet-like objects are sliced, which for QuerySets
+    means ``OFFSET`` and ``LIMIT`` are pushed down to the database."""
+    if hasattr(iterable, 'query') or isinstance(
+        iterable, (list, tuple) + six.string_types,
+    ):
+        return iterable[start:stop]
+    return islice(iterable, start, stop)
+
+
+def _length(iterable):
+    try:
+        return iterable.count()
+    except:
+        try:
+            return len(iterable)
+        except TypeError:
+            return len(list(iterable))
+
+
+def _pushdown_errors():
+    """Returns exceptions which mean that a call cannot be pushed down to
+    an iterable. Django is not imported just for ``FieldError``: if it
+    wasn't imported yet, there are no QuerySets to raise it."""
+    exceptions = sys.modules.get('django.core.exceptions')
+    if exceptions is None:
+        return AttributeError, ValueError, TypeError
+    return AttributeError, ValueError, TypeError, exceptions.FieldError
+
+
+def _fetch(iterable):
+    """Evaluates QuerySet-like iterables, leaves others intact."""
+    if hasattr(iterable, 'query'):
+        return list(iterable)
+    return iterable
+
+
+def _in_thread(function, iterable):
+    """Calls ``function`` in a worker thread. Database connections opened
+    by the thread are closed afterwards."""
+    try:
+        return function(iterable)
+    finally:
+        from django.db import connections
+        for connection in connections.all():
+            connection.close()
+
+
+def _iterator(iterable, chunk_size):
+    """Returns an iterator over values of ``iterable``. QuerySets are
+    streamed with ``iterator()`` in chunks of ``chunk_size`` rows instead of
+    being loaded into their result cache whole."""
+    if not hasattr(iterable, 'iterator'):
+        # e.g. keyset windows, which fetch lazily already
+        return iter(iterable)
+    import django
+    if getattr(iterable, '_prefetch_related_lookups', None):
+        if django.VERSION < (4, 1):
+            # iterator() ignores prefetch_related()
+            return iter(iterable)
+        return iterable.iterator(chunk_size=chunk_size)
+    if django.VERSION < (2, 0):
+        return iterable.iterator()
+    return iterable.iterator(chunk_size=chunk_size)
+
+
+class _streaming(object):
+    """Iterates over a QuerySet with ``iterator()`` so that its values are
+    only held until they're yielded, see ``chain.stream_querysets``."""
+
+    def __init__(self, queryset, chunk_size):
+        self.queryset = queryset
+        self.chunk_size = chunk_size
+        # for instrumentation and the top N selection
+        self.query = queryset.query
+        self.db = queryset.db
+
+    def __iter__(self):
+        return _iterator(self.queryset, self.chunk_size)
+
+
+class _producer(object):
+    """Fetches values of ``iterable`` in a thread of its own and puts them
+    into a queue of at most ``size`` batches of ``batch_size`` values. The
+    thread waits while the queue is full. ``slots`` is a semaphore limiting
+    the number of producers fetching at the same time. Iterating over the
+    producer yields the values, exceptions raised while fetching are
+    re-raised. Database connections opened by the thread are closed when it
+    finishes."""
+
+    def __init__(self, iterable, slots, size, batch_size):
+        # imported here since this is an opt-in feature
+        import threading
+        self.iterable = iterable
+        self.slots = slots
+        self.batch_size = batch_size
+        self.queue = six.moves.queue.Queue(maxsize=size)
+        self.cancelled = threading.Event()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        iterator = None
+        try:
+            while not self.cancelled.is_set():
+                with self.slots:
+                    if iterator is None:
+                        iterator = self.values()
+                    batch = list(islice(iterator, self.batch_size))
+                if not batch or not self.put((batch, None)):
+                    break
+            self.put((None, None))
+        except Exception:
+            self.put((None, sys.exc_info()))
+        finally:
+            # releases the cursor of QuerySet.iterator() while its
+            # connection is still open
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                close()
+            from django.db import connections
+            for connection in connections.all():
+                connection.close()
+
+    def values(self):
+        """Returns an iterator over values of the iterable, see
+        ``_iterator``."""
+        return _iterator(self.iterable, self.batch_size)
+
+    def put(self, item):
+        """Puts ``item`` into the queue unless the producer is cancelled
+        while waiting for space. Returns ``True`` if the item was put."""
+        while not self.cancelled.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except six.moves.queue.Full:
+                continue
+        return False
+
+    def __iter__(self):
+        while True:
+            batch, error = self.queue.get()
+            if error is not None:
+                six.reraise(*error)
+            if batch is None:
+                return
+            for value in batch:
+                yield value
+
+    def close(self):
+        """Stops the thread, waiting for a fetch in progress to finish."""
+        self.cancelled.set()
+        self.thread.join()
+
+
+def _combine_aggregates(kind, values, counts=None):
+    if kind == 'Avg':
+        pairs = [(v, c) for v, c in zip(values, counts) if v is not None]
+        total = sum(c for _, c in pairs)
+        if not total:
+            return None
+        return sum(v * c for v, c in pairs) / total
+    values = [v for v in values if v is not None]
+    if kind == 'Count':
+        return sum(values)
+    if not values:
+        return None
+    if kind == 'Sum':
+        return sum(values)
+    if kind == 'Min':
+        return min(values)
+    return max(values)
+
+
+def _csv_serializer():
+    """Returns a function serializing a batch of rows as CSV text."""
+    import csv
+    buffer = six.StringIO()
+    writer = csv.writer(buffer)
+
+    def serialize(batch):
+        if six.PY2:
+            batch = ([v.encode('utf8') if isinstance(v, six.text_type) else v
+                      for v in row] for row in batch)
+        writer.writerows(batch)
+        text = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return text.decode('utf8') if six.PY2 else text
+    return serialize
+
+
+def _jsonl_serializer(fields):
+    """Returns a function serializing a batch of rows as JSON Lines."""
+    # imported here to avoid settings.py bootstrapping issues
+    from django.core.serializers.json import DjangoJSONEncoder
+    encode = DjangoJSONEncoder(separators=(',', ':')).encode
+
+    def serialize(batch):
+        return ''.join(encode(dict(zip(fields, row))) + '\n'
+                       for row in batch)
+    return serialize
+
+
+def _in_transactions(aliases, function):
+    """Calls ``function`` inside a transaction on every database alias."""
+    if not aliases:
+        return function()
+    from django.db import transaction
+    atomic = getattr(transaction, 'atomic', None)
+    if atomic is None:
+        # Django < 1.6
+        atomic = transaction.commit_on_success
+    with atomic(using=aliases[0]):
+        return _in_transactions(aliases[1:], function)
+
+
+_DATE_KINDS = ('year', 'month', 'week', 'day')
+_DATETIME_KINDS = _DATE_KINDS + ('hour', 'minute', 'second')
+
+
+def _truncate(value, kind, datetimes=False, tzinfo=None):
+    """Truncates a date or datetime ``value`` like ``QuerySet.dates()`` or
+    ``QuerySet.datetimes()`` would. Weeks start on Mondays.
+
+    ``tzinfo`` is only given if ``USE_TZ`` is on. Aware values are then
+    converted to it before truncation, naive datetimes are assumed to be in
+    the default time zone and dates are midnights in ``tzinfo``. Results of
+    ``datetimes`` are aware datetimes in ``tzinfo``."""
+    if tzinfo is not None:
+        # imported here to avoid settings.py bootstrapping issues
+        from django.utils import timezone
+        if isinstance(value, datetime.datetime):
+            if timezone.is_naive(value):
+                value = timezone.make_aware(
+                    value, timezone.get_default_timezone(),
+                )
+            # truncated as a naive value in ``tzinfo``
+            value = timezone.make_naive(value, tzinfo)
+    if datetimes:
+        if not isinstance(value, datetime.datetime):
+            value = datetime.datetime.combine(value, datetime.time())
+    elif isinstance(value, datetime.datetime):
+        value = value.date()
+    if kind == 'year':
+        value = value.replace(month=1, day=1)
+    elif kind == 'month':
+        value = value.replace(day=1)
+    elif kind == 'week':
+        value -= datetime.timedelta(days=value.weekday())
+    if not datetimes:
+        return value
+    fields = ('hour', 'minute', 'second', 'microsecond')
+    precision = _DATETIME_KINDS.index(kind) - len(_DATE_KINDS) + 1
+    kept = fields[:max(precision, 0)]
+    value = value.replace(**dict((str(field), 0) for field in fields
+                                 if field not in kept))
+    if tzinfo is not None:
+        value = timezone.make_aware(value, tzinfo)
+    return value
+
+
+def _use_tz():
+    """Returns ``settings.USE_TZ``. Django is not imported just for this: if
+    it wasn't imported yet, there are no aware values from QuerySets."""
+    conf = sys.modules.get('django.conf')
+    if conf is None:
+        return False
+    from django.core.exceptions import ImproperlyConfigured
+    try:
+        return conf.settings.USE_TZ
+    except ImproperlyConfigured:
+        return False
+
+
+def _label(model):
+    return '{}.{}'.format(model._meta.app_label, model._meta.object_name)
+
+
+def _no_key(value):
+    """``xkey`` used when ordering is only defined by ``order_by``."""
+    return 0
+
+
+class _source(object):
+    """An iterable with declared bounds, see ``chain.source``."""
+
+    def __init__(self, iterable, bounds):
+        self.iterable = iterable
+        self.bounds = {}
+        for field, bound in bounds.items():
+            if not isinstance(bound, (tuple, list)) or len(bound) != 2:
+                bound = (bound, bound)
+            self.bounds[field] = tuple(bound)
+
+
+# maximum number of SELECT statements in a compound query, by vendor
+COMPOUND_SELECT_LIMITS = {
+    'sqlite': 500,
+}
+
+
+class _pruned(tuple):
+    """An empty iterable in place of one that cannot match a filter."""
+
+
+class _windows(object):
+    """Iterates over an ordered QuerySet in keyset windows, see
+    ``chain.fetch_window``. Every window starts after the ordering key of
+    the last value of the previous one and is ``growth`` times larger."""
+
+    growth = 4
+
+    def __init__(self, queryset, rules, size):
+        self.queryset = queryset.order_by(*rules)
+        self.rules = rules
+        self.size = size
+        # for instrumentation
+        self.query = self.queryset.query
+        self.db = self.queryset.db
 
-class chain(object):
+    def __iter__(self):
+        size = self.size
+        window = self.queryset
+        while True:
+            values = list(window[:size])
+            for value in values:
+                yield value
+            if len(values) < size:
+                return
+            window = self.queryset.filter(self.after(values[-1]))
+            size *= self.growth
+
+    def after(self, value):
+        """Returns a ``Q`` object matching rows ordered after ``value``."""
+        # imported here to avoid settings.py bootstrapping issues
+        from django.db.models import Q
+        condition = None
+        equal = {}
+        for rule in self.rules:
+            field = rule.lstrip('-')
+            key = getattr(value, field)
+            lookup = field + ('__lt' if rule[0] == '-' else '__gt')
+            term = Q(**dict(equal, **{lookup: key}))
+            condition = term if condition is None else condition | term
+            equal[field] = key
+        return condition
+
+
+def _unwrap_sources(iterables):
+    """Returns iterables and their bounds (or an empty tuple if no iterable
+    declares bounds)."""
+    if not any(isinstance(it, _source) for it in iterables):
+        return iterables, ()
+    result = []
+    bounds = []
+    for it in iterables:
+        if isinstance(it, _source):
+            result.append(it.iterable)
+            bounds.append(it.bounds)
+        else:
+            result.append(it)
+            bounds.append(None)
+    return result, bounds
+
+
+def _may_match(bounds, lookup, value):
+    """Returns ``False`` if no value within ``bounds`` can match the
+    ``lookup`` with ``value``, ``True`` otherwise."""
+    field, _, operator = lookup.rpartition('__')
+    if operator not in ('exact', 'gt', 'gte', 'lt', 'lte', 'range', 'in'):
+        field, operator = lookup, 'exact'
+    if field not in bounds:
+        return True
+    low, high = bounds[field]
+    try:
+        if operator == 'exact':
+            return ((low is None or low <= value) and
+                    (high is None or value <= high))
+        if operator == 'gt':
+            return high is None or high > value
+        if operator == 'gte':
+            return high is None or high >= value
+        if operator == 'lt':
+            return low is None or low < value
+        if operator == 'lte':
+            return low is None or low <= value
+        if operator == 'range':
+            return ((high is None or value[0] <= high) and
+                    (low is None or low <= value[1]))
+        return any(_may_match(bounds, field, v) for v in value)
+    except TypeError:
+        return True
+
+
+def _format_call(method, args, kwargs):
+    params = [repr(arg) for arg in args]
+    params.extend('{}={!r}'.format(k, v) for k, v in sorted(kwargs.items()))
+    return '{}({})'.format(method, ', '.join(params))
+
+
+def _describe_iterable(iterable):
+    if isinstance(iterable, _producer):
+        iterable = iterable.iterable
+    if isinstance(iterable, _windows):
+        iterable = iterable.queryset
+    if isinstance(iterable, _pruned):
+        return 'nothing (pruned by declared bounds)'
+    model = getattr(iterable, 'model', None)
+    if model is not None:
+        return '{}({}.{})'.format(
+            iterable.__class__.__name__, model._meta.app_label,
+            model.__name__,
+        )
+    return iterable.__class__.__name__
+
+
+class chain(AsyncChainMixin):
     """Enables chaining multiple iterables to serve them lazily as
     a QuerySet-compatible object. Supports collective ``count()``, ``defer``,
     ``exists()``, ``exclude``, ``extra``, ``filter``, ``only``, ``order_by``,
     ``prefetch_related``, ``select_for_update``, ``select_related`` and
-    ``using`` methods.
+    ``using`` methods. Use ``explain()`` to see which of those calls were
+    pushed down to the underlying iterables and what is computed in Python.
 
     Provides special overridable static methods used while yielding values:
 
@@ -59,10 +713,19 @@ class chain(object):
                           iterables should be presorted for the complete result
                           to be sorted properly.
 
+      * ``xfilter_batch(values)`` and ``xform_batch(values)`` - optional
+        counterparts of ``xfilter`` and ``xform`` called with lists of up to
+        ``xbatch_size`` values. If overridden, they are used instead of the
+        per-value hooks.
+
+      * ``xupdate(value, **kwargs)`` and ``xdelete(value)`` - called by
+        ``update()`` and ``delete()`` for values of iterables which are not
+        QuerySets. Not implemented by default.
+
     Known issues:
 
-    1. If slicing or ``xfilter`` is used, reported ``len()`` is computed by
-       iterating over all iterables so performance is weak. Note that ``len()``
+    1. If ``xfilter`` is used, reported ``len()`` is computed by iterating
+       over all iterables so performance is weak. Note that ``len()``
        is used by ``list()`` when you convert your chain to a list or when
        iterating over the chain in Django templates. If this is not expected,
        you can convert to a list using a workaround like this::
@@ -74,18 +737,42 @@ class chain(object):
        hand is also lazy."""
 
     def __init__(self, *iterables, **kwargs):
-        self.iterables = iterables
-        self.start = None
-        self.stop = None
-        self.step = None
-        self.strict = kwargs.get('strict', False)
-        self.xsort = []
-        self.xvalues_mode = None
-        self.xvalues_fields = ()
-        if self.strict:
-            self._django_factory = self._strict_django_factory
-        else:
-            self._django_factory = self._default_django_factory
+        if 'spool_threshold' in kwargs:
+            # one-shot iterators are spooled right away
+            self.spool_threshold = kwargs['spool_threshold']
+        iterables, bounds = _unwrap_sources(iterables)
+        self._plan = _plan(self._spooled(iterables), xbounds=bounds,
+                           strict=kwargs.get('strict', False))
+
+    iterables = _planned('iterables')
+    start = _planned('start')
+    stop = _planned('stop')
+    step = _planned('step')
+    strict = _planned('strict')
+    xsort = _planned('xsort')
+    xvalues_mode = _planned('xvalues_mode')
+    xvalues_fields = _planned('xvalues_fields')
+    xprefetch = _planned('xprefetch')
+    xparallel = _planned('xparallel')
+    xthreads = _planned('xthreads')
+    xqueue = _planned('xqueue')
+    xbounds = _planned('xbounds')
+    xstats = _planned('xstats')
+    xbatch_size = 100
+    spool_threshold = 10000
+    top_n_threshold = 1000
+    approximate_threshold = 1000
+    deep_offset_threshold = 10000
+    coalesce_querysets = True
+    fetch_window = None
+    stream_querysets = False
+
+    # hooks and settings which copies inherit
+    _overridable = ('xfilter', 'xform', 'xkey', 'xform_batch', 'xfilter_batch',
+                    'xupdate', 'xdelete', 'xbatch_size', 'spool_threshold',
+                    'top_n_threshold', 'approximate_threshold',
+                    'deep_offset_threshold', 'coalesce_querysets',
+                    'fetch_window', 'stream_querysets')
 
     @staticmethod
     def xform(value):
@@ -102,6 +789,41 @@ class chain(object):
         always returns ``True``."""
         return True
 
+    @staticmethod
+    def xform_batch(values=unset):
+        """xform_batch(values) -> list of transformed values
+
+        Transform a list of up to ``xbatch_size`` values at once. If
+        overridden, it is used instead of ``xform``. The default
+        implementation does nothing and ``xform`` is called per value."""
+        return unset
+
+    @staticmethod
+    def xfilter_batch(values=unset):
+        """xfilter_batch(values) -> list of bools
+
+        Return a mask telling which of the up to ``xbatch_size`` values should
+        be yielded. If overridden, it is used instead of ``xfilter``. The
+        default implementation does nothing and ``xfilter`` is called per
+        value."""
+        return unset
+
+    @staticmethod
+    def xupdate(value=unset, **kwargs):
+        """xupdate(value, **kwargs)
+
+        Called by ``update()`` for each value of iterables which are not
+        QuerySets. Not implemented by default."""
+        return unset
+
+    @staticmethod
+    def xdelete(value=unset):
+        """xdelete(value)
+
+        Called by ``delete()`` for each value of iterables which are not
+        QuerySets. Not implemented by default."""
+        return unset
+
     @staticmethod
     def xkey(value=unset):
         """xkey(value) -> comparable value
@@ -113,74 +835,644 @@ class chain(object):
     def copy(self, *iterables):
         """Returns a copy of this chain. If `iterables` are provided,
         they are used instead of the ones in the current object."""
-        if not iterables:
-            iterables = self.iterables
-        result = chain(*iterables)
-        result.xfilter = self.xfilter
-        result.xform = self.xform
-        result.xkey = self.xkey
-        result.xsort = list(self.xsort)
-        result.xvalues_mode = self.xvalues_mode
-        result.xvalues_fields = list(self.xvalues_fields)
-        result.start = self.start
-        result.stop = self.stop
-        result.step = self.step
-        result.strict = self.strict
-        return result
+        if iterables:
+            iterables, bounds = _unwrap_sources(iterables)
+            return self._derive(iterables=self._spooled(iterables),
+                                xbounds=bounds, history=None)
+        return self._derive()
 
-    def _filtered_next(self, iterator):
-        """Raises StopIteration just like regular iterator.next()."""
-        result = six.next(iterator)
-        while not self.xfilter(result):
-            result = six.next(iterator)
+    @staticmethod
+    def source(iterable, bounds):
+        """Marks ``iterable`` as containing only values within ``bounds``
+        when passed to a chain. ``bounds`` is a dictionary mapping field names
+        to ``(low, high)`` inclusive ranges (``None`` means unbounded) or to
+        constant values. Collective ``filter`` skips iterables which cannot
+        match and ordered chains concatenate iterables whose ranges of the
+        primary ``order_by`` field don't overlap instead of merging them."""
+        return _source(iterable, bounds)
+
+    def _spooled(self, iterables):
+        """Wraps one-shot iterators (like generators) so that they can be
+        iterated over many times. The first ``spool_threshold`` values are
+        kept in memory, the rest only when ``len()`` or another iteration
+        needs them again, see ``_spool``. Iterables are wrapped when passed
+        to the chain, so the threshold is taken from there: pass it as the
+        ``spool_threshold`` keyword argument to the constructor or set it on
+        a subclass."""
+        next_method = '__next__' if six.PY3 else 'next'
+        return [_spool(it, self.spool_threshold)
+                if hasattr(it, next_method) else it
+                for it in iterables]
+
+    def _derive(self, **changes):
+        """Returns a copy of this chain with the given plan attributes
+        replaced. Unchanged parts of the plan are shared with the original."""
+        result = chain.__new__(chain)
+        result._plan = self._plan.replace(**changes) if changes else self._plan
+        for name in chain._overridable:
+            setattr(result, name, getattr(self, name))
         return result
 
+    def _overridden(self, hook):
+        """Returns ``True`` if the given batch hook was overridden."""
+        try:
+            return getattr(self, hook)() is not unset
+        except TypeError:
+            return True
+
+    def _filtering(self):
+        """Returns ``True`` if ``xfilter`` or ``xfilter_batch`` is used."""
+        try:
+            if not self.xfilter():
+                return True
+        except TypeError:
+            return True
+        return self._overridden('xfilter_batch')
+
+    def _filtered(self, iterable, index=None):
+        """Returns an iterator over values from ``iterable`` which passed
+        ``xfilter_batch`` or ``xfilter``. If the chain is instrumented,
+        statistics are recorded for the iterable at ``index``."""
+        stats = None
+        if self.xstats is not None and index is not None:
+            stats = self.xstats.source(index, iterable)
+            iterable = stats.fetched(iterable)
+        if self._overridden('xfilter_batch'):
+            values = self._batch_filtered(iterable)
+        else:
+            values = six.moves.filter(self.xfilter, iterable)
+        if stats is not None:
+            values = stats.passed(values)
+        return values
+
+    def _batch_filtered(self, iterable):
+        iterator = iter(iterable)
+        while True:
+            values = list(islice(iterator, self.xbatch_size))
+            if not values:
+                break
+            for value in compress(values, self.xfilter_batch(values)):
+                yield value
+
     def __iter__(self):
-        if self.ordered:
-            def _gen():
-                candidates = {}
-                for iterable in self.iterables:
-                    iterator = iter(iterable)
-                    try:
-                        candidates[iterator] = [self._filtered_next(iterator),
-                                                iterator]
-                    except StopIteration:
+        for value in self._transformed(self._elements()):
+            yield value
+
+    def _transformed(self, elements):
+        """Returns an iterator over ``elements`` after prefetching, ``xvalue``
+        and ``xform``."""
+        stats = self.xstats
+        if stats is not None:
+            elements = stats.timed('elements', elements)
+        values = self._prefetched(elements)
+        if stats is not None:
+            values = stats.timed('prefetch', values)
+        values = six.moves.map(self.xvalue, values)
+        if stats is not None:
+            values = stats.timed('xvalue', values)
+        if self.xparallel is not None:
+            values = self._parallel_xform(values)
+        elif self._overridden('xform_batch'):
+            values = self._batch_xform(values)
+        else:
+            values = six.moves.map(self.xform, values)
+        if stats is not None:
+            values = stats.timed('xform', values)
+        return values
+
+    def _batch_xform(self, values):
+        values = iter(values)
+        while True:
+            batch = list(islice(values, self.xbatch_size))
+            if not batch:
+                break
+            for value in self.xform_batch(batch):
+                yield value
+
+    def _prefetched(self, elements):
+        """Runs ``prefetch_related`` lookups in batches of ``xbatch_size``
+        on model instances among ``elements``. Instances are grouped by model
+        so that each lookup is a single query per batch."""
+        if not self.xprefetch:
+            return elements
+        return self._batch_prefetched(elements)
+
+    def _prefetching(self, iterable):
+        """Returns a QuerySet of model instances with ``prefetch_related``
+        applied for ``xprefetch`` lookups starting at an attribute of its
+        model. Other iterables are returned as is. Batches of instances
+        coming from such QuerySets skip the lookups already prefetched."""
+        if (not self._is_queryset(iterable) or
+                not hasattr(iterable, 'prefetch_related') or
+                not hasattr(iterable, 'model') or
+                getattr(iterable, '_fields', None) is not None):
+            return iterable
+        lookups = [
+            lookup for lookup in self.xprefetch
+            if hasattr(iterable.model, getattr(
+                lookup, 'prefetch_through', lookup,
+            ).split('__')[0])
+        ]
+        if not lookups:
+            return iterable
+        return iterable.prefetch_related(*lookups)
+
+    def _batch_prefetched(self, elements):
+        # imported here to avoid settings.py bootstrapping issues
+        import django
+        from django.db.models.query import prefetch_related_objects
+        elements = iter(elements)
+        while True:
+            batch = list(islice(elements, self.xbatch_size))
+            if not batch:
+                break
+            models = {}
+            for element in batch:
+                if hasattr(element, '_meta'):
+                    models.setdefault(element.__class__, []).append(element)
+            for instances in models.values():
+                # old Django versions prefetch to-many relations of
+                # instances from prefetching QuerySets again
+                fetched = [set(getattr(i, '_prefetched_objects_cache', ()))
+                           for i in instances]
+                for lookup in self.xprefetch:
+                    attribute = getattr(lookup, 'prefetch_through',
+                                        lookup).split('__')[0]
+                    pending = [i for i, f in zip(instances, fetched)
+                               if attribute not in f]
+                    if not pending:
                         continue
-                while candidates:
-                    clist = list(candidates.values())
-                    for rule in self.xsort[::-1]:
-                        reverse = rule[0] == '-'
-                        if reverse:
-                            rule = rule[1:]
-                        clist.sort(key=lambda x: getattr(x[0], rule),
-                                   reverse=reverse)
-                    try:
-                        to_yield, iterator = min(clist,
-                                                 key=lambda x: self.xkey(x[0]))
-                        yield to_yield
-                    except ValueError:
-                        # sequence empty
-                        break
                     try:
-                        candidates[iterator] = [self._filtered_next(iterator),
-                                                iterator]
-                    except StopIteration:
-                        del candidates[iterator]
+                        if django.VERSION < (1, 10):
+                            prefetch_related_objects(pending, [lookup])
+                        else:
+                            prefetch_related_objects(pending, lookup)
+                    except (AttributeError, ValueError):
+                        # lookup not applicable to this model
+                        continue
+            for element in batch:
+                yield element
+
+    def _elements(self):
+        """Yields elements which passed ``xfilter``, merged if the chain is
+        ordered and sliced, before ``xvalue`` and ``xform`` are applied."""
+        iterables = self.iterables
+        start, stop = self.start, self.stop
+        field = self._seekable()
+        if field is not None:
+            if stop is not None and stop <= start:
+                return
+            iterables, skipped = self._seek(field)
+            start -= skipped
+            if stop is not None:
+                stop -= skipped
+        # positions of iterables in the chain, for instrumentation
+        indices = six.moves.range(len(iterables))
+        groups = self._coalescible(iterables)
+        if groups:
+            iterables, indices = self._coalesced(iterables, groups)
+        if self.xprefetch and not any((self.start, self.stop, self.step)):
+            # every value is yielded, so QuerySets prefetch in one query each
+            iterables = [self._prefetching(it) for it in iterables]
+        if stop and not self._filtering() and (self.ordered or
+                                               self.xthreads):
+            # no single iterable can contribute more than `stop` values;
+            # the heap selects them from all values of other iterables
+            top_n = self.ordered and self._top_n(stop)
+            iterables = [it if top_n and not hasattr(it, 'query')
+                         else _slice_iterable(it, 0, stop)
+                         for it in iterables]
+        streamed = self._streamed()
+        if self.xthreads and not streamed:
+            iterables = self._map(_fetch, iterables)
+        elif self.ordered and not (stop and not self._filtering()):
+            # fetching grows with the number of values merged
+            iterables = [self._windowed(it) for it in iterables]
+        if streamed:
+            iterables = self._produced(iterables)
+        elif self.stream_querysets and not self.xthreads:
+            iterables = [_streaming(it, self.xbatch_size)
+                         if self._is_queryset(it) else it
+                         for it in iterables]
+        try:
+            for element in self._sliced(iterables, indices, start, stop):
+                yield element
+        finally:
+            for it in iterables:
+                if isinstance(it, _producer):
+                    it.close()
+
+    def _sliced(self, iterables, indices, start, stop):
+        """Yields the slice between ``start`` and ``stop`` of elements of
+        ``iterables``, merged if the chain is ordered."""
+        if self.ordered:
+            top_n = self._top_n(stop)
+            order = self._concatenation_order()
+            if order is not None:
+                # later iterables are only queried when reached
+                elements = itertools.chain.from_iterable(
+                    self._presorted(iterables[index], top_n, index)
+                    for index in order
+                )
+            else:
+                elements = self._merge([
+                    self._presorted(it, top_n, index)
+                    for it, index in zip(iterables, indices)
+                ])
         else:
-            def _gen():  # noqa
-                for it in self.iterables:
-                    for element in it:
-                        if not self.xfilter(element):
-                            continue
-                        yield element
-        for index, element in enumerate(_gen()):
-            if self.start and index < self.start:
+            elements = itertools.chain.from_iterable(
+                self._filtered(it, index)
+                for it, index in zip(iterables, indices)
+            )
+        if self.xstats is not None:
+            elements = self.xstats.timed('merge', elements)
+        for index, element in enumerate(elements):
+            if start and index < start:
                 continue
-            if self.step and (index - (self.start or 0)) % self.step:
+            if self.step and (index - (start or 0)) % self.step:
                 continue
-            if self.stop and index >= self.stop:
+            if stop and index >= stop:
                 break
-            yield self.xform(self.xvalue(element))
+            yield element
+            if stop and index + 1 >= stop:
+                # don't fetch a value past the slice
+                break
+
+    def _streamed(self):
+        """``True`` if QuerySets are fetched by producer threads while the
+        chain is merged, see ``concurrent()``."""
+        return bool(self.ordered and self.xthreads and self.xqueue)
+
+    def _produced(self, iterables):
+        """Returns ``iterables`` with QuerySets replaced by producers,
+        at most ``xthreads`` of which query the database at a time."""
+        # imported here since this is an opt-in feature
+        import threading
+        slots = threading.BoundedSemaphore(self.xthreads)
+        return [_producer(it, slots, self.xqueue, self.xbatch_size)
+                if hasattr(it, 'query') else it
+                for it in iterables]
+
+    def _windowed(self, iterable):
+        """Returns ``iterable`` fetched in keyset windows if it's a QuerySet
+        of model instances ordered like the chain by non-nullable fields of
+        its model. ``iterable`` is returned as is otherwise. The primary key
+        breaks ties so that windows neither skip nor repeat rows."""
+        rules = self._window_rules(iterable)
+        if rules is None:
+            return iterable
+        return _windows(iterable, rules, self.fetch_window)
+
+    def _window_rules(self, iterable):
+        """Returns ordering rules for keyset windows over ``iterable`` or
+        ``None`` if it can't be fetched in windows."""
+        if (not self.fetch_window or not self.xsort or
+                self.xkey is not _no_key):
+            return None
+        if (not self._is_queryset(iterable) or
+                not hasattr(iterable, 'model') or
+                getattr(iterable, '_fields', None) is not None):
+            # values() and values_list() rows don't expose fields by name
+            return None
+        query = iterable.query
+        # ``combinator`` is Django 1.11+
+        if (tuple(query.order_by) != tuple(self.xsort) or
+                not query.can_filter() or query.distinct or
+                getattr(query, 'combinator', None) or query.extra_order_by):
+            return None
+        opts = iterable.model._meta
+        rules = list(self.xsort)
+        names = set()
+        for rule in rules:
+            name = rule.lstrip('-')
+            if name == 'pk':
+                field = opts.pk
+            else:
+                try:
+                    field = opts.get_field(name)
+                except Exception:
+                    # FieldDoesNotExist, moved between Django versions;
+                    # also lookups spanning relations
+                    return None
+            # ``is_relation`` is Django 1.8+
+            relation = getattr(field, 'is_relation',
+                               getattr(field, 'rel', None) is not None)
+            if field.null or relation:
+                # NULLs don't compare, relations order by related models
+                return None
+            names.add(field.name)
+        if opts.pk.name not in names:
+            rules.append('pk')
+        return rules
+
+    def _union_key(self, iterable):
+        """Returns a key shared by QuerySets which can be combined with
+        ``UNION ALL`` or ``None`` if ``iterable`` can't be combined."""
+        if not self._is_queryset(iterable) or not hasattr(iterable, 'union'):
+            return None
+        query = iterable.query
+        if (not query.can_filter() or query.distinct or query.combinator or
+                query.select_for_update or query.extra or query.annotations or
+                query.select_related is not False or
+                getattr(iterable, '_prefetch_related_lookups', None)):
+            return None
+        if self.ordered:
+            if (tuple(query.order_by) != tuple(self.xsort) or
+                    getattr(iterable, '_fields', None) is not None):
+                # rows of values() can't carry the tie-breaking columns
+                return None
+        elif iterable.ordered:
+            # ordering within the QuerySet would be lost
+            return None
+        # imported here to avoid settings.py bootstrapping issues
+        from django.db import connections
+        if not connections[iterable.db].features.supports_select_union:
+            return None
+        deferred, defer = query.deferred_loading
+        return (iterable.model, iterable.db, iterable._iterable_class,
+                tuple(getattr(iterable, '_fields', None) or ()),
+                frozenset(deferred), defer)
+
+    def _coalescible(self, iterables):
+        """Returns lists of positions of neighbouring QuerySets which can be
+        evaluated as a single ``UNION ALL`` query, keeping their order.
+        Ordered chains leave the merge of QuerySets ordered by plain fields
+        to the database. Groups are split to stay within the number of
+        ``SELECT`` statements the database allows in a compound query."""
+        if not self.coalesce_querysets:
+            return []
+        if self.ordered and (
+            self.xkey is not _no_key or
+            self._concatenation_order() is not None or
+            any('__' in rule or rule.lstrip('-') in ('?', 'pk')
+                for rule in self.xsort)
+        ):
+            return []
+        keys = [self._union_key(it) for it in iterables]
+        groups = []
+        run = []
+        for index, (it, key) in enumerate(zip(iterables, keys)):
+            if isinstance(it, _pruned):
+                continue
+            if key is not None and run and keys[run[0]] == key:
+                run.append(index)
+            else:
+                groups.append(run)
+                run = [index]
+        groups.append(run)
+        result = []
+        for group in groups:
+            if len(group) < 2:
+                continue
+            vendor = self._vendor(iterables[group[0]])
+            limit = COMPOUND_SELECT_LIMITS.get(vendor) or len(group)
+            result.extend(group[i:i + limit]
+                          for i in six.moves.range(0, len(group), limit))
+        return [group for group in result if len(group) > 1]
+
+    @staticmethod
+    def _vendor(queryset):
+        # imported here to avoid settings.py bootstrapping issues
+        from django.db import connections
+        return connections[queryset.db].vendor
+
+    def _coalesced(self, iterables, groups):
+        """Replaces each group of QuerySets with their ``UNION ALL``. Returns
+        the new iterables and positions of their first parts. In ordered
+        chains, ties are broken by the position of the QuerySet in the chain
+        like in the merge, then by primary key. The position is selected as
+        the ``_dj_chain_source`` attribute of model instances."""
+        iterables = list(iterables)
+        combined = set()
+        for group in groups:
+            parts = [iterables[index].order_by() for index in group]
+            if self.ordered:
+                # imported here to avoid settings.py bootstrapping issues
+                from django.db.models import IntegerField, Value
+                parts = [part.annotate(_dj_chain_source=Value(
+                    index, output_field=IntegerField(),
+                )) for index, part in zip(group, parts)]
+            union = parts[0].union(*parts[1:], all=True)
+            if self.ordered:
+                union = union.order_by(*self.xsort + ('_dj_chain_source',
+                                                      'pk'))
+            iterables[group[0]] = union
+            combined.update(group[1:])
+        indices = [index for index in six.moves.range(len(iterables))
+                   if index not in combined]
+        return [iterables[index] for index in indices], indices
+
+    def _seekable(self):
+        """Returns the primary ``order_by`` field if the slice's offset is
+        deep enough to be found by searching the values of this field in
+        the database. ``None`` otherwise. Requires every iterable to be
+        a QuerySet ordered like the chain by a non-nullable field."""
+        if not self.start or self.start < self.deep_offset_threshold:
+            return None
+        if (not self.xsort or self.xkey is not _no_key or
+                self._filtering()):
+            return None
+        field = self.xsort[0].lstrip('-')
+        for it in self.iterables:
+            if isinstance(it, _pruned):
+                continue
+            if not hasattr(it, 'query') or not hasattr(it, 'model'):
+                return None
+            query = it.query
+            if (tuple(query.order_by) != tuple(self.xsort) or
+                    not query.can_filter()):
+                return None
+            try:
+                if it.model._meta.get_field(field).null:
+                    # NULLs don't compare but are ordered
+                    return None
+            except Exception:
+                # FieldDoesNotExist, moved between Django versions
+                return None
+        return field
+
+    def _seek(self, field):
+        """Finds the value of ``field`` at rank ``start`` of the merged
+        ordering. Every round the median values of the remaining ranges of
+        all QuerySets are fetched and their weighted median is used as
+        a pivot. Counting values before and up to the pivot in every
+        QuerySet discards at least a quarter of the remaining values, so
+        the search takes O(log N) rounds of O(k) queries.
+
+        Returns QuerySets filtered to start at the found value and the
+        number of values before it."""
+        descending = self.xsort[0][0] == '-'
+        before = field + ('__gt' if descending else '__lt')
+        through = field + ('__gte' if descending else '__lte')
+        since = field + ('__lte' if descending else '__gte')
+        iterables = list(self.iterables)
+        active = [index for index, it in enumerate(iterables)
+                  if not isinstance(it, _pruned)]
+        lo = dict.fromkeys(active, 0)
+        hi = dict(zip(active, self._map(_length, [iterables[index]
+                                                  for index in active])))
+        if self.start >= sum(hi.values()):
+            return [_pruned() for _ in iterables], self.start
+
+        def median(index):
+            middle = (lo[index] + hi[index]) // 2
+            return iterables[index].values_list(field, flat=True)[middle]
+
+        def counts(it):
+            return (it.filter(**{before: pivot}).count(),
+                    it.filter(**{through: pivot}).count())
+
+        while True:
+            ranges = [index for index in active if lo[index] < hi[index]]
+            candidates = sorted(
+                zip(self._map(median, ranges),
+                    [hi[index] - lo[index] for index in ranges]),
+                key=lambda candidate: candidate[0], reverse=descending,
+            )
+            remaining = sum(weight for _, weight in candidates)
+            weight = 0
+            for pivot, size in candidates:
+                weight += size
+                if 2 * weight >= remaining:
+                    break
+            bounds = dict(zip(active, self._map(counts, [
+                iterables[index] for index in active
+            ])))
+            skipped = sum(b[0] for b in bounds.values())
+            if skipped <= self.start < sum(b[1] for b in bounds.values()):
+                break
+            for index in active:
+                if self.start < skipped:
+                    hi[index] = min(hi[index], bounds[index][0])
+                else:
+                    lo[index] = max(lo[index], bounds[index][1])
+        for index in active:
+            iterables[index] = iterables[index].filter(**{since: pivot})
+        return iterables, skipped
+
+    def _presorted(self, iterable, top_n=False, index=None):
+        """Returns an iterator over filtered values from ``iterable``. With
+        ``top_n``, values from iterables other than QuerySets are sorted
+        and only the first ``stop`` of them are kept."""
+        values = self._filtered(iterable, index)
+        if top_n and not hasattr(iterable, 'query') and not isinstance(
+            iterable, _producer,
+        ):
+            # doesn't need to be presorted
+            return iter(heapq.nsmallest(self.stop, values,
+                                        key=self._ordering_key))
+        return values
+
+    def _top_n(self, stop):
+        """``True`` if the first ``stop`` values of iterables other than
+        QuerySets are selected with a heap instead of being presorted."""
+        return bool(self.xsort and stop and stop <= self.top_n_threshold)
+
+    def _merge(self, iterators):
+        """Merges values from presorted ``iterators``."""
+        candidates = {}
+        for iterator in iterators:
+            try:
+                candidates[iterator] = [six.next(iterator), iterator]
+            except StopIteration:
+                continue
+        while candidates:
+            # in the order of iterators so that ties are yielded from the
+            # first one, dictionaries aren't ordered before Python 3.7
+            clist = [candidates[it] for it in iterators if it in candidates]
+            for rule in self.xsort[::-1]:
+                reverse = rule[0] == '-'
+                if reverse:
+                    rule = rule[1:]
+                clist.sort(key=lambda x: getattr(x[0], rule),
+                           reverse=reverse)
+            try:
+                to_yield, iterator = min(clist,
+                                         key=lambda x: self.xkey(x[0]))
+                yield to_yield
+            except ValueError:
+                # sequence empty
+                break
+            try:
+                candidates[iterator] = [six.next(iterator), iterator]
+            except StopIteration:
+                del candidates[iterator]
+
+    def _concatenation_order(self):
+        """Returns indices of iterables in the order in which they can be
+        concatenated instead of merged, or ``None`` if that's not possible.
+        Requires every non-empty iterable to declare non-overlapping bounds of
+        the primary ``order_by`` field."""
+        if not self.xsort or self.xkey is not _no_key or not self.xbounds:
+            return None
+        field = self.xsort[0].lstrip('-')
+        ranges = []
+        for index, (iterable, bounds) in enumerate(zip(self.iterables,
+                                                       self.xbounds)):
+            if isinstance(iterable, _pruned):
+                continue
+            if not bounds or field not in bounds:
+                return None
+            ranges.append((bounds[field], index))
+        try:
+            ranges.sort(key=lambda r: (r[0][0] is not None, r[0][0]))
+            for (previous, _), (current, _) in zip(ranges, ranges[1:]):
+                if previous[1] is None or current[0] is None or not (
+                    previous[1] < current[0]
+                ):
+                    return None
+        except TypeError:
+            return None
+        order = [index for _, index in ranges]
+        if self.xsort[0][0] == '-':
+            order.reverse()
+        return order
+
+    def _ordering_key(self, value):
+        """Returns an object which compares like ``value`` would during
+        merging: by ``xkey`` first, then by ``order_by`` rules."""
+        values = []
+        reverse = []
+        for rule in self.xsort:
+            reverse.append(rule[0] == '-')
+            values.append(getattr(value, rule.lstrip('-')))
+        return _ordering_key(self.xkey(value), values, reverse)
+
+    def _parallel_xform(self, values):
+        """Applies ``xform`` on batches of ``values`` using an executor,
+        yielding results in the original order. At most ``prefetch`` batches
+        are in flight at any given time."""
+        executor, workers, batch, prefetch = self.xparallel
+        own_executor = not hasattr(executor, 'submit')
+        if own_executor:
+            # imported here since this is an opt-in feature
+            from concurrent import futures
+            if executor == 'process':
+                executor = futures.ProcessPoolExecutor(max_workers=workers)
+            else:
+                executor = futures.ThreadPoolExecutor(max_workers=workers)
+        if self._overridden('xform_batch'):
+            xform_batch = self.xform_batch
+        else:
+            xform_batch = partial(_xform_batch, self.xform)
+        pending = deque()
+        try:
+            values = iter(values)
+            while True:
+                while len(pending) < prefetch:
+                    chunk = list(islice(values, batch))
+                    if not chunk:
+                        break
+                    pending.append(executor.submit(xform_batch, chunk))
+                if not pending:
+                    break
+                for value in pending.popleft().result():
+                    yield value
+        finally:
+            for future in pending:
+                future.cancel()
+            if own_executor:
+                executor.shutdown(wait=True)
 
     def xvalue(self, value):
         """For each field listed in ``xvalues_fields`` try to:
@@ -236,18 +1528,17 @@ class chain(object):
                     key.stop and key.stop < 0,
                     key.step and key.step < 0)):
                 raise ValueError("chains do not support negative indexing")
-            result = self.copy()
-            result.start = key.start
-            result.stop = key.stop
-            result.step = key.step
+            result = self._derive(start=key.start, stop=key.stop,
+                                  step=key.step)
         elif isinstance(key, int):
             if key < 0:
                 raise ValueError("chains do not support negative indexing")
-            self_without_transform = self.copy()
-            self_without_transform.xform = lambda x: x
-            for index, elem in enumerate(self_without_transform):
-                if index == key:
-                    return self.xform(elem)
+            elements = islice(self._elements(), key, key + 1)
+            for value in self._prefetched(elements):
+                value = self.xvalue(value)
+                if self._overridden('xform_batch'):
+                    return self.xform_batch([value])[0]
+                return self.xform(value)
             raise IndexError("chain index out of range")
         else:
             raise ValueError("chain supports only integer indexing and "
@@ -255,69 +1546,315 @@ class chain(object):
         return result
 
     def __len_parts__(self):
-        for iterable in self.iterables:
-            try:
-                yield iterable.count()
-            except:
-                try:
-                    yield len(iterable)
-                except TypeError:
-                    yield len(list(iterable))
+        if self.xthreads:
+            for length in self._map(_length, self.iterables):
+                yield length
+        else:
+            for iterable in self.iterables:
+                yield _length(iterable)
+
+    def _map(self, function, iterables):
+        """Returns a list of ``function`` results for every iterable, computed
+        concurrently if the chain uses threads."""
+        if not self.xthreads:
+            return [function(it) for it in iterables]
+        # imported here since this is an opt-in feature
+        from concurrent import futures
+        with futures.ThreadPoolExecutor(max_workers=self.xthreads) as pool:
+            return list(pool.map(partial(_in_thread, function), iterables))
 
     def __len__(self):
-        try:
-            if all((self.xfilter(),
-                    not self.start,
-                    not self.stop,
-                    not self.step or self.step == 1)):
-                # fast __len__
-                sum = 0
-                for sub in self.__len_parts__():
-                    sum += sub
-                return sum
-        except TypeError:
-            pass
-        # slow __len__ if xfilter or slicing was used
+        if not self._filtering():
+            # fast __len__, slices are computed arithmetically
+            total = 0
+            for sub in self.__len_parts__():
+                total += sub
+            if not any((self.start, self.stop, self.step)):
+                return total
+            window = slice(self.start, self.stop, self.step)
+            return len(six.moves.range(*window.indices(total)))
+        # slow __len__ if xfilter was used
         length = 0
-        for length, _ in enumerate(self):
-            pass
-        return length + 1
+        for _ in self._elements():
+            length += 1
+        return length
+
+    def _is_queryset(self, iterable):
+        if self.strict:
+            # imported here to avoid settings.py bootstrapping issues
+            from django.db.models.query import QuerySet
+            return isinstance(iterable, QuerySet)
+        return hasattr(iterable, 'query') and hasattr(iterable, 'db')
+
+    def _bulk(self, hook, function):
+        """Calls ``function`` on every iterable inside a transaction on every
+        database used by the QuerySets in the chain."""
+        if self._filtering() or any((self.start, self.stop, self.step)):
+            raise TypeError("Cannot modify objects in a chain with xfilter or "
+                            "slicing.")
+        # iterables pruned by filter() have no objects to modify
+        iterables = [it for it in self.iterables
+                     if not isinstance(it, _pruned)]
+        aliases = []
+        for it in iterables:
+            if self._is_queryset(it):
+                if it.db not in aliases:
+                    aliases.append(it.db)
+            elif not self._overridden(hook):
+                raise TypeError("{!r} is not a QuerySet, override {} to "
+                                "handle it.".format(it, hook))
+
+        def _all():
+            for it in iterables:
+                function(it)
+        _in_transactions(aliases, _all)
+
+    def _django_factory(self, _method, *args, **kwargs):
+        """Calls ``_method`` collectively on all compatible iterables and
+        returns a new chain with the results."""
+        if self.strict:
+            return self._strict_django_factory(_method, *args, **kwargs)
+        return self._default_django_factory(_method, *args, **kwargs)
 
     def _default_django_factory(self, _method, *args, **kwargs):
         """Used if strict=False while constructing the chain."""
         new_iterables = []
+        pushed = []
         for it in self.iterables:
             try:
                 new_iterables.append(getattr(it, _method)(*args, **kwargs))
-            except (AttributeError, ValueError, TypeError, FieldError):
+                pushed.append(True)
+            except _pushdown_errors():
                 new_iterables.append(it)
-        return self.copy(*new_iterables)
+                pushed.append(False)
+        return self._derive(
+            iterables=new_iterables,
+            history=(self._plan.history, _method, args, kwargs, tuple(pushed)),
+        )
 
     def _strict_django_factory(self, _method, *args, **kwargs):
         """Used if strict=True while constructing the chain."""
         # imported here to avoid settings.py bootstrapping issues
         from django.db.models.query import QuerySet
         new_iterables = []
+        pushed = []
         for it in self.iterables:
             if isinstance(it, QuerySet):
                 new_iterables.append(getattr(it, _method)(*args, **kwargs))
+                pushed.append(True)
             else:
                 new_iterables.append(it)
-        return self.copy(*new_iterables)
+                pushed.append(False)
+        return self._derive(
+            iterables=new_iterables,
+            history=(self._plan.history, _method, args, kwargs, tuple(pushed)),
+        )
+
+    def aggregate(self, *args, **kwargs):
+        """QuerySet-compatible ``aggregate`` method. Every iterable needs to
+        support ``aggregate``. Results of ``Count``, ``Sum``, ``Min``, ``Max``
+        and ``Avg`` are combined across iterables, other aggregates raise
+        ``TypeError``. Slicing and ``xfilter`` are not taken into account so
+        they cannot be used together with ``aggregate``."""
+        # imported here to avoid settings.py bootstrapping issues
+        from django.db.models import Count
+        if self._filtering() or any((self.start, self.stop, self.step)):
+            raise TypeError("aggregate() cannot be used on chains with "
+                            "xfilter or slicing.")
+        # iterables pruned by filter() don't contribute to any aggregate
+        iterables = [it for it in self.iterables
+                     if not isinstance(it, _pruned)]
+        for it in iterables:
+            if not hasattr(it, 'aggregate'):
+                raise TypeError("aggregate() requires all iterables to "
+                                "support it, {!r} does not".format(it))
+        aggregates = dict(kwargs)
+        for arg in args:
+            aggregates[arg.default_alias] = arg
+        queries = dict(aggregates)
+        for name, agg in aggregates.items():
+            kind = agg.__class__.__name__
+            if kind not in ('Count', 'Sum', 'Min', 'Max', 'Avg'):
+                raise TypeError("{} cannot be combined across "
+                                "iterables.".format(kind))
+            if getattr(agg, 'distinct', False) or getattr(
+                agg, 'extra', {},
+            ).get('distinct'):
+                raise TypeError("distinct aggregates cannot be combined "
+                                "across iterables.")
+            if kind == 'Avg':
+                if hasattr(agg, 'lookup'):
+                    count = Count(agg.lookup)
+                else:
+                    count = Count(*agg.get_source_expressions(),
+                                  filter=agg.filter)
+                queries[name + '__chaincount'] = count
+        results = self._map(lambda it: it.aggregate(**queries), iterables)
+        combined = {}
+        for name, agg in aggregates.items():
+            combined[name] = _combine_aggregates(
+                agg.__class__.__name__,
+                [result[name] for result in results],
+                [result.get(name + '__chaincount') for result in results],
+            )
+        return combined
 
     def all(self):
         return self
 
-    def count(self):
+    def concurrent(self, workers=None, queue_size=None):
+        """Returns a chain which evaluates its QuerySets concurrently using
+        a pool of ``workers`` threads, each with its own database connection.
+        Objects are fetched eagerly from all QuerySets (up to the slice's upper
+        bound) before they are merged and yielded. Pass ``0`` to disable.
+
+        With ``queue_size``, ordered chains stream QuerySets instead: every
+        QuerySet is fetched by a producer thread of its own into a queue of
+        at most ``queue_size`` batches of ``xbatch_size`` objects, which the
+        merge consumes. Producers wait while their queue is full and stop
+        when iteration stops. At most ``workers`` of them query the database
+        at a time. Queries run by producers aren't counted in the
+        ``queries`` of ``instrumented()`` statistics since they use
+        connections of their own threads."""
+        if workers is None:
+            workers = len(self.iterables) or 1
+        if queue_size is not None and queue_size < 1:
+            raise ValueError("queue_size must be a positive integer")
+        return self._derive(xthreads=workers or None, xqueue=queue_size)
+
+    def count(self, approximate=False):
         """QuerySet-compatible ``count`` method. Supports multiple iterables.
+
+        If ``approximate`` is ``True``, QuerySets are counted using database
+        statistics or planner estimates where available (see
+        ``dj.chain.estimate``). Exact counts are used when no estimate is
+        available or when it's below ``approximate_threshold``. Other
+        iterables are counted as usual. Approximate counts are not available
+        for chains using ``xfilter``.
         """
-        return len(self)
+        if not approximate or self._filtering():
+            return len(self)
+        total = 0
+        for sub in self._map(self._approximate_length, self.iterables):
+            total += sub
+        if not any((self.start, self.stop, self.step)):
+            return total
+        window = slice(self.start, self.stop, self.step)
+        return len(six.moves.range(*window.indices(total)))
+
+    def _approximate_length(self, iterable):
+        if hasattr(iterable, 'query') and hasattr(iterable, 'db'):
+            from dj.chain.estimate import estimated_count
+            estimate = estimated_count(iterable)
+            if estimate is not None and estimate >= self.approximate_threshold:
+                return estimate
+        return _length(iterable)
+
+    def dates(self, field_name, kind, order='ASC'):
+        """QuerySet-compatible ``dates`` method. Returns a sorted list of
+        distinct dates truncated to ``kind``. Calls ``dates()`` on QuerySets
+        and truncates values of other iterables in Python. Chains using
+        ``xfilter`` or slicing are evaluated in Python altogether."""
+        return self._dates(field_name, kind, order)
+
+    def datetimes(self, field_name, kind, order='ASC', tzinfo=None):
+        """QuerySet-compatible ``datetimes`` method, see ``dates``."""
+        return self._dates(field_name, kind, order, datetimes=True,
+                           tzinfo=tzinfo)
+
+    def _dates(self, field_name, kind, order, datetimes=False, tzinfo=None):
+        kinds = _DATETIME_KINDS if datetimes else _DATE_KINDS
+        if kind not in kinds:
+            raise ValueError("'kind' must be one of {}.".format(
+                ', '.join("'{}'".format(k) for k in kinds),
+            ))
+        if order not in ('ASC', 'DESC'):
+            raise ValueError("'order' must be either 'ASC' or 'DESC'.")
+        extractor = self._derive(xvalues_mode=tuple,
+                                 xvalues_fields=(field_name,))
+        local = None
+        if _use_tz():
+            # imported here to avoid settings.py bootstrapping issues
+            from django.utils import timezone
+            local = tzinfo or timezone.get_current_timezone()
+
+        def _truncated(values):
+            result = set()
+            for value in values:
+                if value is not None:
+                    result.add(_truncate(value, kind, datetimes, local))
+            return result
+
+        def _distinct(it):
+            if not self._is_queryset(it):
+                return _truncated(six.moves.map(extractor.xvalue, it))
+            import django
+            if datetimes and not hasattr(it, 'datetimes'):
+                # Django < 1.6: distinct values are truncated in Python
+                return _truncated(
+                    it.values_list(field_name, flat=True).distinct(),
+                )
+            if kind == 'week' and django.VERSION < (1, 11):
+                # Django < 1.11: distinct days are truncated in Python
+                if datetimes:
+                    return _truncated(
+                        it.datetimes(field_name, 'day', tzinfo=tzinfo),
+                    )
+                return _truncated(it.dates(field_name, 'day'))
+            if datetimes:
+                return set(it.datetimes(field_name, kind, tzinfo=tzinfo))
+            return set(
+                # Django < 1.6 returns datetimes
+                value.date() if isinstance(value, datetime.datetime)
+                else value for value in it.dates(field_name, kind)
+            )
+
+        if self._filtering() or any((self.start, self.stop, self.step)):
+            result = _truncated(six.moves.map(extractor.xvalue,
+                                              self._elements()))
+        else:
+            result = set()
+            for values in self._map(_distinct, self.iterables):
+                result.update(values)
+        return sorted(result, reverse=order == 'DESC')
 
     def defer(self, *args, **kwargs):
         """QuerySet-compatible ``defer`` method. Will silently skip filtering
         for incompatible iterables."""
         return self._django_factory('defer', *args, **kwargs)
 
+    def delete(self):
+        """Deletes all objects in the chain. QuerySets are deleted in bulk
+        inside a transaction on each of their databases. Other iterables are
+        rejected with ``TypeError`` unless ``xdelete(value)`` is overridden,
+        in which case it's called for each of their values.
+
+        Returns a tuple with the total number of objects deleted and
+        a dictionary with the number of deletions per object type, like
+        ``QuerySet.delete()`` on Django 1.9+."""
+        import django
+        total = [0]
+        per_model = {}
+
+        def _delete(it):
+            if self._is_queryset(it):
+                if django.VERSION < (1, 9):
+                    deleted = {_label(it.model): it.count()}
+                    it.delete()
+                else:
+                    deleted = it.delete()[1]
+                for label, count in deleted.items():
+                    per_model[label] = per_model.get(label, 0) + count
+                    total[0] += count
+            else:
+                for value in it:
+                    self.xdelete(value)
+                    label = value.__class__.__name__
+                    per_model[label] = per_model.get(label, 0) + 1
+                    total[0] += 1
+        self._bulk('xdelete', _delete)
+        return total[0], per_model
+
     def exclude(self, *args, **kwargs):
         """QuerySet-compatible ``exclude`` method. Will silently skip filtering
         for incompatible iterables."""
@@ -328,6 +1865,210 @@ class chain(object):
         """
         return bool(len(self))
 
+    def explain(self):
+        """Returns a human-readable description of how the chain will be
+        evaluated: for each iterable, which collective calls were pushed down
+        to it and what SQL it will run (for QuerySets), followed by the
+        operations executed in Python while iterating."""
+        calls = self._plan.calls()
+        lines = ['chain of {} iterable(s)'.format(len(self.iterables))]
+        if self.xthreads:
+            lines[0] += ', evaluated concurrently by {} threads'.format(
+                self.xthreads,
+            )
+            if self._streamed():
+                lines[0] += ' streaming into queues of {} batches'.format(
+                    self.xqueue,
+                )
+        elif self.stream_querysets:
+            lines[0] += ', QuerySets read with iterator()'
+        for index, it in enumerate(self.iterables):
+            lines.append('[{}] {}'.format(index, _describe_iterable(it)))
+            if self.xbounds and self.xbounds[index]:
+                lines.append('    bounds: ' + ', '.join(
+                    '{}={!r}'.format(field, bound)
+                    for field, bound in sorted(self.xbounds[index].items())
+                ))
+            pushed = []
+            skipped = []
+            for method, args, kwargs, mask in calls:
+                if index >= len(mask):
+                    continue
+                call = _format_call(method, args, kwargs)
+                (pushed if mask[index] else skipped).append(call)
+            if pushed:
+                lines.append('    pushed down: ' + ', '.join(pushed))
+            if skipped:
+                lines.append('    ignored: ' + ', '.join(skipped))
+            query = getattr(it, 'query', None)
+            if query is not None:
+                try:
+                    sql = six.text_type(query)
+                except Exception as e:
+                    sql = '<unavailable: {}>'.format(e.__class__.__name__)
+                lines.append('    SQL: ' + sql)
+            elif not hasattr(it, '__len__') and not hasattr(it, 'count'):
+                lines.append('    len() iterates over all values')
+        python = []
+        if self._overridden('xfilter_batch'):
+            python.append('xfilter_batch')
+        elif self._filtering():
+            python.append('xfilter')
+        if self.ordered and self._concatenation_order() is not None:
+            python.append('concatenate by declared bounds of {}'.format(
+                str(self.xsort[0]),
+            ))
+        elif self.ordered:
+            python.append('merge by order_by{} and xkey'.format(
+                tuple(str(rule) for rule in self.xsort),
+            ))
+        for group in self._coalescible(self.iterables):
+            python.append('UNION ALL of iterables {}'.format(
+                ', '.join(str(index) for index in group),
+            ))
+        windowing = not self.xthreads or self._streamed()
+        if self.ordered and windowing and not (
+            self.stop and not self._filtering()
+        ):
+            coalesced = set(itertools.chain.from_iterable(
+                self._coalescible(self.iterables),
+            ))
+            windowed = [str(index) for index, it in enumerate(self.iterables)
+                        if index not in coalesced and
+                        self._window_rules(it) is not None]
+            if windowed:
+                python.append(
+                    'keyset windows of {}, {}, ... rows from iterables '
+                    '{}'.format(self.fetch_window,
+                                self.fetch_window * _windows.growth,
+                                ', '.join(windowed)),
+                )
+        if self._seekable() is not None:
+            python.append('seek to offset {} by counting values of {} in '
+                          'QuerySets'.format(self.start, self.xsort[0]))
+        if self.ordered:
+            if self.stop and not self._filtering():
+                python.append('at most {} values per iterable'.format(
+                    self.stop,
+                ))
+            if self._top_n(self.stop):
+                python.append('top {} of iterables other than QuerySets '
+                              'selected with a heap'.format(self.stop))
+        if self.start or self.stop or self.step:
+            python.append('slice [{}:{}:{}]'.format(
+                self.start or '', self.stop or '', self.step or '',
+            ))
+        if self.xprefetch:
+            python.append('prefetch_related{} per {} yielded objects'.format(
+                tuple(str(lookup) for lookup in self.xprefetch),
+                self.xbatch_size,
+            ))
+        if self.xvalues_mode:
+            python.append('xvalue {}{}'.format(
+                self.xvalues_mode.__name__,
+                tuple(str(f) for f in self.xvalues_fields),
+            ))
+        batched = self._overridden('xform_batch')
+        if batched or self.xform is not chain.xform:
+            if self.xparallel is None:
+                python.append('xform_batch' if batched else 'xform')
+            else:
+                executor, workers, batch, prefetch = self.xparallel
+                python.append(
+                    'parallel {} ({}, {} workers, batches of {}, {} in '
+                    'flight)'.format(
+                        'xform_batch' if batched else 'xform',
+                        executor
+                        if isinstance(executor, six.string_types)
+                        else executor.__class__.__name__,
+                        workers or 'default', batch, prefetch,
+                    )
+                )
+        if self.xstats is not None:
+            python.append('record stats')
+        lines.append('python: ' + (', '.join(python) or 'nothing'))
+        return '\n'.join(lines)
+
+    def export(self, fileobj, fields, format='csv', header=True,
+               buffer_size=1024 * 1024):
+        """Writes ``fields`` of every object in the chain to ``fileobj`` as
+        CSV or JSON Lines (``format='jsonl'``). Returns the number of objects
+        written. See ``export_chunks()`` for details."""
+        count = 0
+        for chunk, rows in self._export(fields, format, header, buffer_size):
+            fileobj.write(chunk)
+            count += rows
+        return count
+
+    def export_chunks(self, fields, format='csv', header=True,
+                      buffer_size=1024 * 1024):
+        """Yields ``fields`` of every object in the chain serialized as CSV
+        or JSON Lines (``format='jsonl'``) in chunks of at least
+        ``buffer_size`` characters (except for the last one). Suitable for
+        ``StreamingHttpResponse``.
+
+        ``values_list(*fields)`` is read with ``iterator()`` from QuerySets
+        so that neither model instances nor the entire result set are held
+        in memory, see ``stream_querysets``. Other iterables use the
+        ``xvalue`` algorithm."""
+        for chunk, _ in self._export(fields, format, header, buffer_size):
+            yield chunk
+
+    def _export(self, fields, format, header, buffer_size):
+        """Yields ``(text, row_count)`` chunks."""
+        if not fields:
+            raise TypeError("export() requires at least one field.")
+        buffered = []
+        size = 0
+        count = 0
+        if format == 'csv':
+            serialize = _csv_serializer()
+            if header:
+                buffered.append(serialize([fields]))
+        elif format == 'jsonl':
+            serialize = _jsonl_serializer(fields)
+        else:
+            raise ValueError("Unsupported export format: {!r}".format(format))
+        rows = iter(self._export_rows(fields))
+        while True:
+            batch = list(islice(rows, self.xbatch_size))
+            if not batch:
+                break
+            text = serialize(batch)
+            buffered.append(text)
+            size += len(text)
+            count += len(batch)
+            if size >= buffer_size:
+                yield ''.join(buffered), count
+                buffered = []
+                size = 0
+                count = 0
+        if buffered:
+            yield ''.join(buffered), count
+
+    def _export_rows(self, fields):
+        if any((self.ordered, self._filtering(), self.start, self.stop,
+                self.step, self.xform is not chain.xform,
+                self._overridden('xform_batch'))):
+            rows = self.values_list(*fields)
+            rows.stream_querysets = True
+            return rows
+        extractor = self._derive(xvalues_mode=list, xvalues_fields=fields)
+
+        def _rows():
+            for it in self.iterables:
+                rows = None
+                if not self.strict or hasattr(it, 'query'):
+                    try:
+                        rows = it.values_list(*fields).iterator()
+                    except _pushdown_errors():
+                        pass
+                if rows is None:
+                    rows = six.moves.map(extractor.xvalue, it)
+                for row in rows:
+                    yield row
+        return _rows()
+
     def extra(self, *args, **kwargs):
         """QuerySet-compatible ``extra`` method. Will silently skip filtering
         for incompatible iterables."""
@@ -335,8 +2076,40 @@ class chain(object):
 
     def filter(self, *args, **kwargs):
         """QuerySet-compatible ``filter`` method. Will silently skip filtering
-        for incompatible iterables."""
-        return self._django_factory('filter', *args, **kwargs)
+        for incompatible iterables. Iterables with declared bounds that cannot
+        match keyword lookups are replaced with empty ones."""
+        result = self._django_factory('filter', *args, **kwargs)
+        if not self.xbounds or not kwargs:
+            return result
+        iterables = list(result.iterables)
+        for index, bounds in enumerate(self.xbounds):
+            if bounds and not all(_may_match(bounds, lookup, value)
+                                  for lookup, value in kwargs.items()):
+                iterables[index] = _pruned()
+        return result._derive(iterables=iterables)
+
+    def get(self, *args, **kwargs):
+        """QuerySet-compatible ``get`` method. Filters the chain if arguments
+        are given and returns the only matching value. Raises
+        ``ObjectDoesNotExist`` or ``MultipleObjectsReturned`` otherwise."""
+        c = self.filter(*args, **kwargs) if args or kwargs else self
+        if not any((c.start, c.stop, c.step)):
+            # pushes LIMIT down to ordered QuerySets
+            c = c[:2]
+        return c._single([value for value in islice(c, 2)])
+
+    @staticmethod
+    def _single(values):
+        from django.core.exceptions import (
+            MultipleObjectsReturned, ObjectDoesNotExist,
+        )
+        if not values:
+            raise ObjectDoesNotExist("chain matching query does not exist.")
+        if len(values) > 1:
+            raise MultipleObjectsReturned(
+                "get() returned more than one value from the chain.",
+            )
+        return values[0]
 
     def none(self, *args, **kwargs):
         return chain()
@@ -351,10 +2124,10 @@ class chain(object):
         other than QuerySets but they need to be presorted for the chain to
         return consistently ordered results."""
         result = self._django_factory('order_by', *args, **kwargs)
-        result.xsort.extend(args)
+        result.xsort += args
         try:
             if self.xkey() is unset:
-                result.xkey = lambda v: 0
+                result.xkey = _no_key
         except TypeError:
             pass
         return result
@@ -370,10 +2143,60 @@ class chain(object):
         except TypeError:
             return True
 
-    def prefetch_related(self, *args, **kwargs):
-        """QuerySet-compatible ``prefetch_related`` method. Will silently skip
-        filtering for incompatible iterables."""
-        return self._django_factory('prefetch_related', *args, **kwargs)
+    def instrumented(self, stats=None):
+        """Returns a chain which records statistics of its evaluation in
+        ``stats``, a new ``dj.chain.stats.ChainStats`` object by default.
+        Chains derived from the result share the same ``stats``, available
+        as the ``stats`` attribute. Only synchronous iteration is measured.
+        """
+        if stats is None:
+            from dj.chain.stats import ChainStats
+            stats = ChainStats()
+        return self._derive(xstats=stats)
+
+    @property
+    def stats(self):
+        """Statistics recorded by an ``instrumented()`` chain or ``None``.
+        """
+        return self.xstats
+
+    def parallel_xform(self, executor='thread', workers=None, batch=100,
+                       prefetch=None):
+        """Returns a chain which applies ``xform`` concurrently on batches of
+        ``batch`` values. ``executor`` is either ``'thread'``, ``'process'``
+        or an existing ``concurrent.futures.Executor`` instance which will
+        not be shut down by the chain. Results are yielded in the same order
+        as without parallelism. At most ``prefetch`` batches (by default
+        twice the number of workers) are submitted ahead of the consumer.
+
+        If ``xform_batch`` is overridden, it is submitted instead of
+        ``xform``. Slicing and ``xfilter`` are applied before values are
+        submitted so no work is wasted. With ``'process'`` both ``xform``
+        and the values need to be picklable."""
+        if executor not in ('thread', 'process') and not hasattr(
+            executor, 'submit',
+        ):
+            raise ValueError("executor must be 'thread', 'process' or an "
+                             "Executor instance")
+        if batch < 1:
+            raise ValueError("batch must be a positive integer")
+        if prefetch is None:
+            prefetch = 2 * (workers or 4)
+        if prefetch < 1:
+            raise ValueError("prefetch must be a positive integer")
+        return self._derive(xparallel=(executor, workers, batch, prefetch))
+
+    def prefetch_related(self, *lookups):
+        """QuerySet-compatible ``prefetch_related`` method. Unlike other
+        collective methods, lookups are not passed to individual QuerySets.
+        Instead, they are performed on model instances actually yielded by the
+        chain, after merging and slicing, in batches of ``xbatch_size``.
+        Unsliced chains yield every object, so their QuerySets prefetch with
+        a single query each instead. Lookups are silently skipped for
+        incompatible objects. Calling with ``None`` clears the lookups."""
+        if lookups == (None,):
+            return self._derive(xprefetch=())
+        return self._derive(xprefetch=self.xprefetch + lookups)
 
     def select_for_update(self, *args, **kwargs):
         """QuerySet-compatible ``select_for_update`` method. Will silently skip
@@ -385,6 +2208,33 @@ class chain(object):
         filtering for incompatible iterables."""
         return self._django_factory('select_related', *args, **kwargs)
 
+    @classmethod
+    def sharded(cls, queryset, aliases, workers=None):
+        """Returns a concurrent chain of ``queryset`` on every database alias
+        in ``aliases``. Counts, iteration and aggregates are executed on all
+        databases at once using up to ``workers`` threads (by default one
+        per alias)."""
+        result = cls(*[queryset.using(alias) for alias in aliases])
+        return result.concurrent(workers or len(aliases))
+
+    def update(self, **kwargs):
+        """Updates all objects in the chain with ``kwargs``. QuerySets are
+        updated in bulk inside a transaction on each of their databases.
+        Other iterables are rejected with ``TypeError`` unless
+        ``xupdate(value, **kwargs)`` is overridden, in which case it's called
+        for each of their values. Returns the number of objects updated."""
+        total = [0]
+
+        def _update(it):
+            if self._is_queryset(it):
+                total[0] += it.update(**kwargs)
+            else:
+                for value in it:
+                    self.xupdate(value, **kwargs)
+                    total[0] += 1
+        self._bulk('xupdate', _update)
+        return total[0]
+
     def using(self, *args, **kwargs):
         """QuerySet-compatible ``using`` method. Will silently skip filtering
         for incompatible iterables."""
@@ -401,12 +2251,8 @@ class chain(object):
         """
         result = self._django_factory('values', *fields)
         if fields:
-            result.xvalues_mode = dict
-            result.xvalues_fields = fields
-        else:
-            result.xvalues_mode = None
-            result.xvalues_fields = ()
-        return result
+            return result._derive(xvalues_mode=dict, xvalues_fields=fields)
+        return result._derive(xvalues_mode=None, xvalues_fields=())
 
     def values_list(self, *fields, **kwargs):
         """QuerySet-compatible ``values_list`` method. If ``fields`` are not
@@ -425,11 +2271,9 @@ class chain(object):
             raise TypeError("'flat' is not valid when values_list is called "
                             "with more than one field.")
         if fields:
-            result = self.copy()
-            result.xvalues_mode = tuple if flat else list
-            result.xvalues_fields = fields
+            result = self._derive(xvalues_mode=tuple if flat else list,
+                                  xvalues_fields=fields)
         else:
             result = self._django_factory('values_list', *fields)
-            result.xvalues_mode = None
-            result.xvalues_fields = ()
+            result = result._derive(xvalues_mode=None, xvalues_fields=())
         return result
@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2011 - 2012 by Łukasz Langa
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""dj.chain.aio
+   ------------
+
+    Asynchronous iteration, counting and lookups on chains. Requires
+    Python 3.6+."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import heapq
+from itertools import compress
+
+
+def sync_to_async(function):
+    """``asgiref.sync.sync_to_async``, imported on first use like asyncio so
+    that importing ``dj.chain`` stays cheap."""
+    try:
+        from asgiref.sync import sync_to_async
+    except ImportError:
+        # Django < 3.0 doesn't guard against database access in event loops
+        async def wrapper(*args, **kwargs):
+            return function(*args, **kwargs)
+        return wrapper
+    return sync_to_async(function)
+
+
+_exhausted = object()
+
+
+def _is_async(iterable):
+    """``True`` for QuerySet-like and async iterables."""
+    return hasattr(iterable, 'query') or hasattr(iterable, '__aiter__')
+
+
+async def _aiterate(iterable):
+    """Yields values of ``iterable``. QuerySets are streamed with
+    ``aiterator()`` where available (Django 4.1+) or fetched in a thread,
+    async iterables are awaited and other iterables are iterated over
+    directly."""
+    if hasattr(iterable, 'aiterator') and not getattr(
+        iterable, '_prefetch_related_lookups', None,
+    ):
+        async for value in iterable.aiterator():
+            yield value
+    elif hasattr(iterable, '__aiter__'):
+        async for value in iterable:
+            yield value
+    elif hasattr(iterable, 'query'):
+        for value in await sync_to_async(list)(iterable):
+            yield value
+    else:
+        for value in iterable:
+            yield value
+
+
+async def _abatches(values, size):
+    """Yields lists of up to ``size`` values from the async iterator."""
+    batch = []
+    async for value in values:
+        batch.append(value)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def _anext(iterator):
+    try:
+        return await iterator.__anext__()
+    except StopAsyncIteration:
+        return _exhausted
+
+
+async def _alength(iterable):
+    if hasattr(iterable, 'acount'):
+        return await iterable.acount()
+    if hasattr(iterable, '__aiter__'):
+        length = 0
+        async for _ in iterable:
+            length += 1
+        return length
+    # imported here to avoid a circular import
+    from dj.chain import _length
+    if hasattr(iterable, 'query'):
+        return await sync_to_async(_length)(iterable)
+    return _length(iterable)
+
+
+async def _aexists(iterable):
+    if hasattr(iterable, 'aexists'):
+        return await iterable.aexists()
+    if hasattr(iterable, 'query'):
+        return await sync_to_async(iterable.exists)()
+    return await _anext(_aiterate(iterable)) is not _exhausted
+
+
+class AsyncChainMixin(object):
+    """Async counterparts of chain iteration, ``count()``, ``exists()`` and
+    ``get()``. QuerySets are queried concurrently where the result doesn't
+    depend on their order: for counting, for existence checks and for the
+    first values of an ordered merge. Async iterables are accepted as sources
+    but, unlike other iterables, they can only be consumed once and only
+    through this API."""
+
+    async def __aiter__(self):
+        if not (self.xprefetch or self.xparallel is not None or
+                self._overridden('xform_batch')):
+            async for element in self._aelements():
+                yield self.xform(self.xvalue(element))
+            return
+        async for batch in _abatches(self._aelements(), self.xbatch_size):
+            # prefetching and batch hooks run synchronously
+            for value in await sync_to_async(list)(self._transformed(batch)):
+                yield value
+
+    async def _aelements(self):
+        """Async counterpart of ``_elements``."""
+        # imported here to avoid a circular import
+        from dj.chain import _slice_iterable
+        iterables = self.iterables
+        if self.stop and not self._filtering():
+            # no single iterable can contribute more than `stop` values
+            iterables = [_slice_iterable(it, 0, self.stop)
+                         if not hasattr(it, '__aiter__') or
+                         hasattr(it, 'query') else it
+                         for it in iterables]
+        top_n = (self.xsort and self.stop and
+                 self.stop <= self.top_n_threshold)
+        if self.ordered:
+            order = self._concatenation_order()
+            if order is None:
+                elements = self._amerge([self._apresorted(it, top_n)
+                                         for it in iterables])
+            else:
+                elements = self._aconcatenated(
+                    self._apresorted(iterables[index], top_n)
+                    for index in order
+                )
+        else:
+            elements = self._aconcatenated(self._apresorted(it)
+                                           for it in iterables)
+        index = 0
+        async for element in elements:
+            if self.start and index < self.start:
+                index += 1
+                continue
+            if self.step and (index - (self.start or 0)) % self.step:
+                index += 1
+                continue
+            if self.stop and index >= self.stop:
+                break
+            yield element
+            index += 1
+            if self.stop and index >= self.stop:
+                # don't fetch a value past the slice
+                break
+
+    def _apresorted(self, iterable, top_n=False):
+        """Async counterpart of ``_presorted``."""
+        if not _is_async(iterable):
+            return _aiterate(self._presorted(iterable, top_n))
+        return self._afiltered(iterable)
+
+    async def _afiltered(self, iterable):
+        if self._overridden('xfilter_batch'):
+            async for batch in _abatches(_aiterate(iterable),
+                                         self.xbatch_size):
+                for value in compress(batch, self.xfilter_batch(batch)):
+                    yield value
+        else:
+            async for value in _aiterate(iterable):
+                if self.xfilter(value):
+                    yield value
+
+    async def _aconcatenated(self, iterators):
+        for iterator in iterators:
+            async for value in iterator:
+                yield value
+
+    async def _amerge(self, iterators):
+        """Merges values from presorted async ``iterators``. First values
+        are fetched concurrently."""
+        import asyncio
+        heads = await asyncio.gather(*[_anext(it) for it in iterators])
+        heap = [(self._ordering_key(value), index, value)
+                for index, value in enumerate(heads)
+                if value is not _exhausted]
+        heapq.heapify(heap)
+        while heap:
+            _, index, value = heap[0]
+            yield value
+            value = await _anext(iterators[index])
+            if value is _exhausted:
+                heapq.heappop(heap)
+            else:
+                heapq.heapreplace(
+                    heap, (self._ordering_key(value), index, value),
+                )
+
+    async def acount(self):
+        """Async counterpart of ``count()``. Iterables are counted
+        concurrently."""
+        import asyncio
+        if self._filtering():
+            length = 0
+            async for _ in self._aelements():
+                length += 1
+            return length
+        lengths = await asyncio.gather(*[_alength(it)
+                                         for it in self.iterables])
+        total = sum(lengths)
+        if not any((self.start, self.stop, self.step)):
+            return total
+        window = slice(self.start, self.stop, self.step)
+        return len(range(*window.indices(total)))
+
+    async def aexists(self):
+        """Async counterpart of ``exists()``. Iterables are checked
+        concurrently."""
+        if self._filtering():
+            return await _anext(self._aelements()) is not _exhausted
+        if any((self.start, self.stop, self.step)):
+            return bool(await self.acount())
+        import asyncio
+        return any(await asyncio.gather(*[_aexists(it)
+                                          for it in self.iterables]))
+
+    async def aget(self, *args, **kwargs):
+        """Async counterpart of ``get()``."""
+        c = self.filter(*args, **kwargs) if args or kwargs else self
+        if not any((c.start, c.stop, c.step)):
+            # pushes LIMIT down to QuerySets
+            c = c[:2]
+        values = []
+        async for value in c:
+            values.append(value)
+            if len(values) == 2:
+                break
+        return c._single(values)
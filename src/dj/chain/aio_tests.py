@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2012 by Łukasz Langa
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Tests for asynchronous chains, mixed into ``MediaTest``. Requires
+Python 3.6+."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+
+class AsyncMediaTests(object):
+    def test_async(self):
+        from asgiref.sync import async_to_sync
+        from django.core.exceptions import ObjectDoesNotExist
+        from dj.chain import chain
+
+        async def titles(c):
+            return [value.title async for value in c]
+
+        async def generator(values):
+            for value in values:
+                yield value
+
+        media = chain(self.Video.objects.all(), self.Song.objects.all())
+        by_duration = media.order_by('duration')
+        self.assertEqual(
+            [v.title for v in by_duration],
+            async_to_sync(titles)(by_duration),
+        )
+        self.assertEqual(
+            [v.title for v in by_duration[2:5]],
+            async_to_sync(titles)(by_duration[2:5]),
+        )
+        self.assertEqual(
+            [v.title for v in media.filter(duration__gt=250)],
+            async_to_sync(titles)(media.filter(duration__gt=250)),
+        )
+        self.assertEqual(8, async_to_sync(media.acount)())
+        self.assertEqual(3, async_to_sync(media[2:5].acount)())
+        self.assertTrue(async_to_sync(media.aexists)())
+        self.assertFalse(async_to_sync(media.filter(duration=1).aexists)())
+        self.assertEqual('Baby', async_to_sync(media.aget)(duration=225).title)
+        self.assertRaises(ObjectDoesNotExist,
+                          async_to_sync(media.aget), duration=1)
+        books = chain(generator(self.books), self.Video.objects.all())
+        self.assertEqual(6, async_to_sync(books.acount)())
+        books = chain(generator(self.books), self.Video.objects.all())
+        self.assertEqual(
+            ['A Tale of Two Cities', 'Don Quixote', 'Gangnam Style'],
+            async_to_sync(titles)(books[:3]),
+        )
+        # ties are merged in the order of iterables, like in __iter__
+        self.Video(author='Various', title='Zebra', duration=1000,
+                   resolution=1).save()
+        self.Song(artist='Various', title='Apple', duration=1000,
+                  genre=1).save()
+        by_duration = chain(self.Video.objects.all(),
+                            self.Song.objects.all()).order_by('duration')
+        self.assertEqual(['Zebra', 'Apple'],
+                         [v.title for v in by_duration][-2:])
+        self.assertEqual(
+            [v.title for v in by_duration],
+            async_to_sync(titles)(by_duration),
+        )
@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2011 - 2012 by Łukasz Langa
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""dj.chain.bench
+   --------------
+
+    Micro-benchmarks of the chain iteration engine on synthetic in-memory
+    iterables. Run with::
+
+        python -m dj.chain.bench [--save] [--baseline PATH] [--quick]
+
+    Every benchmark reports rows processed per second and peak memory
+    (on Python 3). Results are compared against a stored baseline."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+from collections import deque, namedtuple
+import gc
+import json
+import os
+import random
+import subprocess
+import sys
+from timeit import default_timer
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2
+    tracemalloc = None
+
+from dj.chain import chain
+
+
+FIELDS = ('a', 'b', 'c', 'd')
+Row = namedtuple('Row', FIELDS + ('title',))
+BENCHMARKS = []
+DEFAULT_BASELINE = 'chain-bench.json'
+
+
+def benchmark(name):
+    """Registers a function returning a ``(workload, rows)`` tuple for
+    the given number of rows. ``workload`` is called without arguments,
+    ``rows`` is the number of rows it processes."""
+    def decorator(function):
+        BENCHMARKS.append((name, function))
+        return function
+    return decorator
+
+
+def sources(size, count, rules=0):
+    """Returns ``count`` lists with ``size`` rows in total. With ``rules``,
+    lists are presorted by that many leading ``FIELDS``."""
+    rng = random.Random(count)
+    result = [[] for _ in range(count)]
+    for index in range(size):
+        result[index % count].append(Row(
+            rng.randint(0, 9), rng.randint(0, 99), rng.randint(0, 999),
+            index, 'row {}'.format(index),
+        ))
+    if rules:
+        def key(row):
+            return tuple(getattr(row, f) for f in FIELDS[:rules])
+        for rows in result:
+            rows.sort(key=key)
+    return result
+
+
+def consume(iterable):
+    """Iterates over ``iterable`` without calling ``len()`` on it."""
+    deque(iter(iterable), maxlen=0)
+
+
+class odd_chain(chain):
+    @staticmethod
+    def xfilter(value):
+        return value.d % 2
+
+
+@benchmark('iterate unordered')
+def iterate_unordered(size):
+    c = chain(*sources(size, 10))
+    return lambda: consume(c), size
+
+
+def _ordered(count, rules):
+    def bench(size):
+        c = chain(*sources(size, count, rules)).order_by(*FIELDS[:rules])
+        return lambda: consume(c), size
+    return bench
+
+
+for _count in (1, 10, 100):
+    for _rules in (1, 4):
+        benchmark('merge {} sources by {} rule(s)'.format(_count, _rules))(
+            _ordered(_count, _rules),
+        )
+
+
+@benchmark('slice at deep offset (unordered)')
+def slice_unordered(size):
+    c = chain(*sources(size, 10))[size - 100:]
+    return lambda: consume(c), size
+
+
+@benchmark('slice at deep offset (ordered)')
+def slice_ordered(size):
+    c = chain(*sources(size, 10, 1)).order_by('a')[size - 100:]
+    return lambda: consume(c), size
+
+
+@benchmark('values()')
+def values(size):
+    c = chain(*sources(size, 10)).values('a', 'title')
+    return lambda: consume(c), size
+
+
+@benchmark('values_list()')
+def values_list(size):
+    c = chain(*sources(size, 10)).values_list('a', 'title')
+    return lambda: consume(c), size
+
+
+@benchmark('values_list(flat=True)')
+def values_list_flat(size):
+    c = chain(*sources(size, 10)).values_list('title', flat=True)
+    return lambda: consume(c), size
+
+
+@benchmark('len() with xfilter')
+def len_filtered(size):
+    c = odd_chain(*sources(size, 10))
+    return lambda: len(c), size
+
+
+@benchmark('len() of a slice')
+def len_sliced(size):
+    c = chain(*sources(size, 10))[10:size - 10:3]
+    return lambda: len(c), size
+
+
+@benchmark('integer index')
+def index(size):
+    c = chain(*sources(size, 10))
+    return lambda: c[size - 1], size
+
+
+IMPORT_CHECK = """
+import sys
+import dj.chain
+c = dj.chain.chain([1, 3], (2, 4)).order_by('real')[1:3].values_list(
+    'real', flat=True)
+assert list(c) == [2, 3], list(c)
+loaded = sorted(m for m in sys.modules if m.split('.')[0] in {modules!r})
+assert not loaded, 'imported ' + ', '.join(loaded)
+"""
+
+
+def python(code):
+    """Runs ``code`` in a fresh interpreter with the current ``sys.path``.
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(p for p in sys.path if p)
+    subprocess.check_call([sys.executable, '-c', code], env=env)
+
+
+@benchmark('import dj.chain')
+def import_time(size):
+    """Spawns an interpreter which imports ``dj.chain`` without importing
+    Django and chains plain iterables. Measures imports per second."""
+    code = IMPORT_CHECK.format(modules=('django', 'asyncio', 'asgiref'))
+    return lambda: python(code), 1
+
+
+def measure(workload, repeat):
+    """Returns the best time out of ``repeat`` runs and peak memory in bytes
+    of a single run (``None`` if ``tracemalloc`` is not available)."""
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        start = default_timer()
+        workload()
+        elapsed = default_timer() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    peak = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+        try:
+            workload()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return best, peak
+
+
+def run(size=100000, repeat=3, names=None, out=sys.stdout):
+    """Runs benchmarks (all of them or those listed in ``names``) and
+    returns a dictionary of results."""
+    results = {}
+    for name, function in BENCHMARKS:
+        if names and name not in names:
+            continue
+        workload, rows = function(size)
+        elapsed, peak = measure(workload, repeat)
+        results[name] = {
+            'seconds': elapsed,
+            'rows_per_second': rows / elapsed if elapsed else None,
+            'peak_memory': peak,
+        }
+        print('.', end='', file=out)
+        out.flush()
+    print(file=out)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Returns a list of ``(name, result, ratio, regressed)`` tuples where
+    ``ratio`` is the throughput relative to the baseline (``None`` if there
+    is no baseline for the benchmark)."""
+    comparison = []
+    for name, _ in BENCHMARKS:
+        if name not in results:
+            continue
+        result = results[name]
+        ratio = None
+        before = baseline.get(name, {}).get('rows_per_second')
+        if before and result['rows_per_second']:
+            ratio = result['rows_per_second'] / before
+        regressed = ratio is not None and ratio < 1 - tolerance
+        comparison.append((name, result, ratio, regressed))
+    return comparison
+
+
+def report(comparison, out=sys.stdout):
+    print('{:<36} {:>14} {:>12} {:>10}'.format(
+        'benchmark', 'rows/s', 'peak KiB', 'baseline',
+    ), file=out)
+    for name, result, ratio, regressed in comparison:
+        peak = result['peak_memory']
+        print('{:<36} {:>14,.0f} {:>12} {:>10}{}'.format(
+            name, result['rows_per_second'] or 0,
+            '-' if peak is None else '{:,}'.format(peak // 1024),
+            '-' if ratio is None else '{:.2f}x'.format(ratio),
+            ' REGRESSION' if regressed else '',
+        ), file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Micro-benchmarks of the chain iteration engine.',
+    )
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE,
+                        help='results to compare against (default: '
+                             '%(default)s)')
+    parser.add_argument('--save', action='store_true',
+                        help='store results as the new baseline')
+    parser.add_argument('--size', type=int, default=100000,
+                        help='rows per benchmark (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs per benchmark, the best one counts '
+                             '(default: %(default)s)')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='relative throughput drop reported as '
+                             'a regression (default: %(default)s)')
+    parser.add_argument('--quick', action='store_true',
+                        help='use 10000 rows and a single run')
+    parser.add_argument('names', nargs='*', metavar='benchmark',
+                        help='benchmarks to run (default: all)')
+    args = parser.parse_args(argv)
+    if args.quick:
+        args.size, args.repeat = 10000, 1
+    results = run(args.size, args.repeat, args.names)
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    comparison = compare(results, baseline, args.tolerance)
+    report(comparison)
+    if args.save:
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+    return 1 if any(c[3] for c in comparison) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2011 - 2012 by Łukasz Langa
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""dj.chain.estimate
+   -----------------
+
+    Row count estimates based on database statistics."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+
+from django.db import DatabaseError, connections, transaction
+
+
+TABLE_ESTIMATES = {
+    'postgresql': "SELECT reltuples FROM pg_class WHERE oid = %s::regclass",
+    'sqlite': "SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1",
+    'mysql': "SELECT table_rows FROM information_schema.tables "
+             "WHERE table_schema = DATABASE() AND table_name = %s",
+    'oracle': "SELECT num_rows FROM user_tables WHERE table_name = UPPER(%s)",
+}
+
+
+def _unfiltered(query):
+    return not any((
+        query.where, query.distinct, query.low_mark, query.high_mark,
+        getattr(query, 'extra', None), getattr(query, 'annotations', None),
+    ))
+
+
+def estimated_count(queryset):
+    """Returns the number of rows in ``queryset`` as estimated by the
+    database or ``None`` if no estimate is available.
+
+    Unfiltered QuerySets use table statistics: ``reltuples`` on PostgreSQL,
+    ``sqlite_stat1`` on SQLite (filled by ``ANALYZE``), ``information_schema``
+    on MySQL and ``user_tables`` on Oracle. Filtered QuerySets use the
+    planner's estimate on PostgreSQL."""
+    # a failing query inside the caller's transaction would abort it
+    atomic = getattr(transaction, 'atomic', None)
+    try:
+        if atomic is None:
+            # Django < 1.6
+            estimate = _estimate_in_savepoint(queryset)
+        else:
+            with atomic(using=queryset.db, savepoint=True):
+                estimate = _estimate(queryset)
+    except DatabaseError:
+        # no statistics available
+        return None
+    if estimate is None or estimate < 0:
+        # PostgreSQL: table was never analyzed
+        return None
+    return estimate
+
+
+def _estimate_in_savepoint(queryset):
+    """Calls ``_estimate`` in a savepoint which is rolled back if the query
+    fails. Savepoints are no-ops on backends which don't support them."""
+    sid = transaction.savepoint(using=queryset.db)
+    try:
+        estimate = _estimate(queryset)
+    except DatabaseError:
+        transaction.savepoint_rollback(sid, using=queryset.db)
+        raise
+    transaction.savepoint_commit(sid, using=queryset.db)
+    return estimate
+
+
+def _estimate(queryset):
+    query = queryset.query
+    connection = connections[queryset.db]
+    vendor = connection.vendor
+    cursor = connection.cursor()
+    try:
+        if _unfiltered(query) and vendor in TABLE_ESTIMATES:
+            cursor.execute(TABLE_ESTIMATES[vendor],
+                           [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+            if row is None or row[0] is None:
+                return None
+            return int(float(str(row[0]).split()[0]))
+        if vendor == 'postgresql':
+            sql, params = query.sql_with_params()
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+            plan = cursor.fetchone()[0]
+            if not isinstance(plan, list):
+                plan = json.loads(plan)
+            return int(plan[0]['Plan']['Plan Rows'])
+        return None
+    finally:
+        cursor.close()
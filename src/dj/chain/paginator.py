@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2011 - 2012 by Łukasz Langa
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""dj.chain.paginator
+   ------------------
+
+    A Django paginator aware of chains."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from django.core.paginator import EmptyPage, Page, PageNotAnInteger, Paginator
+
+from dj.chain import chain, _slice_iterable
+
+
+class ChainPaginator(Paginator):
+    """A ``Paginator`` for chains. Lengths of individual iterables are
+    computed once per paginator and reused to map each page onto per-iterable
+    windows, so that for unordered chains every QuerySet only fetches the rows
+    which end up on the requested page. Ordered chains push the page's upper
+    bound down to each iterable instead.
+
+    If ``exact_count`` is ``False``, no counts are computed. Instead,
+    a single additional object is fetched to tell whether there is a next
+    page. In this mode ``count`` and ``num_pages`` are ``None``.
+
+    Chains using ``xfilter`` or a step in their slice are paginated like any
+    other object list."""
+
+    def __init__(self, object_list, per_page, orphans=0,
+                 allow_empty_first_page=True, exact_count=True):
+        super(ChainPaginator, self).__init__(
+            object_list, per_page, orphans=orphans,
+            allow_empty_first_page=allow_empty_first_page,
+        )
+        self.exact_count = exact_count
+        self._parts = None
+        self._count = None
+
+    @property
+    def windowed(self):
+        """``True`` if pages can be mapped onto iterables directly."""
+        c = self.object_list
+        return (isinstance(c, chain) and not c._filtering() and
+                (not c.step or c.step == 1))
+
+    @property
+    def parts(self):
+        """Memoized lengths of iterables in the chain."""
+        if self._parts is None:
+            self._parts = list(self.object_list.__len_parts__())
+        return self._parts
+
+    @property
+    def count(self):
+        if not self.exact_count:
+            return None
+        if self._count is None:
+            if self.windowed:
+                c = self.object_list
+                total = sum(self.parts)
+                window = slice(c.start, c.stop, c.step)
+                start, stop, _ = window.indices(total)
+                self._count = max(stop - start, 0)
+            else:
+                try:
+                    self._count = self.object_list.count()
+                except (AttributeError, TypeError):
+                    self._count = len(self.object_list)
+        return self._count
+
+    @property
+    def num_pages(self):
+        if not self.exact_count:
+            return None
+        if self.count == 0 and not self.allow_empty_first_page:
+            return 0
+        hits = max(1, self.count - self.orphans)
+        return (hits + self.per_page - 1) // self.per_page
+
+    def validate_number(self, number):
+        if self.exact_count:
+            return super(ChainPaginator, self).validate_number(number)
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('That page number is not an integer')
+        if number < 1:
+            raise EmptyPage('That page number is less than 1')
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        top = bottom + self.per_page
+        if not self.exact_count:
+            objects = [obj for obj in self.window(bottom, top + 1)]
+            has_next = len(objects) > self.per_page
+            if not objects and number > 1:
+                raise EmptyPage('That page contains no results')
+            return ChainPage(objects[:self.per_page], number, self,
+                             has_next=has_next)
+        if top + self.orphans >= self.count:
+            top = self.count
+        objects = [obj for obj in self.window(bottom, top)]
+        return ChainPage(objects, number, self)
+
+    def window(self, bottom, top):
+        """Returns objects between ``bottom`` and ``top`` as a chain of
+        per-iterable slices (for unordered chains with ``exact_count``) or as
+        a slice of the chain. Without ``exact_count`` every iterable of
+        an unordered chain is limited to ``top`` objects."""
+        c = self.object_list
+        if not self.windowed:
+            return c[bottom:top]
+        start = (c.start or 0) + bottom
+        stop = (c.start or 0) + top
+        if c.stop is not None:
+            stop = min(stop, c.stop)
+            start = min(start, stop)
+        if c.ordered:
+            return c._derive(start=start or None, stop=stop, step=None)
+        if not self.exact_count:
+            # without counts offsets within iterables are unknown but no
+            # iterable contributes more than `stop` values
+            return c._derive(
+                iterables=[_slice_iterable(it, 0, stop)
+                           for it in c.iterables],
+                start=start or None, stop=stop, step=None, xbounds=(),
+                history=None,
+            )
+        iterables = []
+        offset = 0
+        for iterable, length in zip(c.iterables, self.parts):
+            lo = max(start - offset, 0)
+            hi = min(stop - offset, length)
+            if lo < hi:
+                iterables.append(_slice_iterable(iterable, lo, hi))
+            offset += length
+        return c._derive(iterables=iterables, start=None, stop=None,
+                         step=None, xbounds=(), history=None)
+
+
+class ChainPage(Page):
+    """A ``Page`` which also works when the paginator doesn't know the total
+    count."""
+
+    def __init__(self, object_list, number, paginator, has_next=None):
+        super(ChainPage, self).__init__(object_list, number, paginator)
+        self._has_next = has_next
+
+    def __repr__(self):
+        if self.paginator.exact_count:
+            return super(ChainPage, self).__repr__()
+        return '<Page {}>'.format(self.number)
+
+    def has_next(self):
+        if self.paginator.exact_count:
+            return super(ChainPage, self).has_next()
+        return self._has_next
+
+    def start_index(self):
+        if self.paginator.exact_count:
+            return super(ChainPage, self).start_index()
+        if not len(self):
+            return 0
+        return (self.paginator.per_page * (self.number - 1)) + 1
+
+    def end_index(self):
+        if self.paginator.exact_count:
+            return super(ChainPage, self).end_index()
+        return (self.paginator.per_page * (self.number - 1)) + len(self)
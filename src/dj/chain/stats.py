@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2011 - 2012 by Łukasz Langa
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""dj.chain.stats
+   --------------
+
+    Opt-in instrumentation of chain evaluation, see ``chain.instrumented``.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from timeit import default_timer
+
+import six
+
+
+class _stage(object):
+    """Cumulative time spent pulling values through an iterator and the
+    number of values pulled."""
+
+    __slots__ = ('seconds', 'rows')
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.rows = 0
+
+    def timed(self, iterable):
+        iterator = None
+        while True:
+            start = default_timer()
+            try:
+                if iterator is None:
+                    iterator = iter(iterable)
+                value = six.next(iterator)
+            except StopIteration:
+                self.seconds += default_timer() - start
+                return
+            self.seconds += default_timer() - start
+            self.rows += 1
+            yield value
+
+
+class SourceStats(object):
+    """Statistics of a single iterable of the chain.
+
+    ``first_row`` is the time it took to fetch the first value during the
+    last evaluation, ``fetch_time`` is the total time spent fetching values
+    (running queries included), ``filter_time`` is the time spent in
+    ``xfilter``. ``queries`` are only counted for QuerySets on Django
+    2.0+."""
+
+    def __init__(self, label):
+        self.label = label
+        self.first_row = None
+        self.fetch_time = 0.0
+        self.rows_fetched = 0
+        self.queries = 0
+        self._passed = _stage()
+
+    @property
+    def rows_passed(self):
+        """Number of fetched values which passed ``xfilter``."""
+        return self._passed.rows
+
+    @property
+    def rows_filtered(self):
+        """Number of fetched values dropped by ``xfilter``."""
+        return self.rows_fetched - self.rows_passed
+
+    @property
+    def filter_time(self):
+        return max(self._passed.seconds - self.fetch_time, 0.0)
+
+    def fetched(self, iterable):
+        """Yields values of ``iterable`` measuring the time and queries it
+        takes to fetch them."""
+        connection = None
+        if hasattr(iterable, 'query') and hasattr(iterable, 'db'):
+            # imported here to avoid settings.py bootstrapping issues
+            from django.db import connections
+            connection = connections[iterable.db]
+        wrappers = getattr(connection, 'execute_wrappers', None)
+        iterator = first_row = None
+        while True:
+            if wrappers is not None:
+                wrappers.append(self._count_query)
+            start = default_timer()
+            try:
+                if iterator is None:
+                    # evaluating a QuerySet runs its query
+                    iterator = iter(iterable)
+                value = six.next(iterator)
+            except StopIteration:
+                self.fetch_time += default_timer() - start
+                return
+            finally:
+                if wrappers is not None:
+                    wrappers.remove(self._count_query)
+            elapsed = default_timer() - start
+            self.fetch_time += elapsed
+            self.rows_fetched += 1
+            if first_row is None:
+                first_row = self.first_row = elapsed
+            yield value
+
+    def passed(self, values):
+        """Yields ``values`` which passed ``xfilter``, counting them."""
+        return self._passed.timed(values)
+
+    def _count_query(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+
+class ChainStats(object):
+    """Statistics of evaluations of an instrumented chain, accumulated over
+    all chains derived from it. Times are in seconds and don't include time
+    spent by the code consuming the chain.
+
+    ``sources`` holds ``SourceStats`` for each iterable, ``merge_time`` is
+    spent merging (or concatenating) and slicing values, ``prefetch_time``,
+    ``xvalue_time`` and ``xform_time`` are spent in the respective steps.
+    ``rows_skipped`` values were dropped by slicing, ``rows_yielded`` were
+    returned by the chain. Use ``metrics()`` to send the statistics to
+    a monitoring system."""
+
+    def __init__(self):
+        self.sources = []
+        self._stages = dict((name, _stage()) for name in (
+            'merge', 'elements', 'prefetch', 'xvalue', 'xform',
+        ))
+
+    def source(self, index, iterable):
+        """Returns ``SourceStats`` of the iterable at ``index``."""
+        # imported here to avoid a circular import
+        from dj.chain import _describe_iterable
+        while len(self.sources) <= index:
+            self.sources.append(None)
+        if self.sources[index] is None:
+            self.sources[index] = SourceStats(_describe_iterable(iterable))
+        return self.sources[index]
+
+    def timed(self, stage, iterable):
+        return self._stages[stage].timed(iterable)
+
+    def _exclusive(self, stage, previous):
+        return max(self._stages[stage].seconds -
+                   self._stages[previous].seconds, 0.0)
+
+    @property
+    def merge_time(self):
+        sources = sum(s._passed.seconds for s in self.sources if s)
+        return max(self._stages['elements'].seconds - sources, 0.0)
+
+    @property
+    def prefetch_time(self):
+        return self._exclusive('prefetch', 'elements')
+
+    @property
+    def xvalue_time(self):
+        return self._exclusive('xvalue', 'prefetch')
+
+    @property
+    def xform_time(self):
+        return self._exclusive('xform', 'xvalue')
+
+    @property
+    def rows_skipped(self):
+        return self._stages['merge'].rows - self._stages['elements'].rows
+
+    @property
+    def rows_yielded(self):
+        return self._stages['xform'].rows
+
+    def metrics(self, prefix='dj_chain'):
+        """Returns a list of ``(name, value, labels)`` tuples. ``labels``
+        identify the iterable for per-iterable metrics, suitable for
+        Prometheus-style collectors. For StatsD, join the labels into the
+        name. Names of timings end with ``_seconds``."""
+        result = [
+            ('{}_merge_seconds'.format(prefix), self.merge_time, {}),
+            ('{}_prefetch_seconds'.format(prefix), self.prefetch_time, {}),
+            ('{}_xvalue_seconds'.format(prefix), self.xvalue_time, {}),
+            ('{}_xform_seconds'.format(prefix), self.xform_time, {}),
+            ('{}_rows_skipped'.format(prefix), self.rows_skipped, {}),
+            ('{}_rows_yielded'.format(prefix), self.rows_yielded, {}),
+        ]
+        for index, source in enumerate(self.sources):
+            if source is None:
+                continue
+            labels = {'source': str(index), 'iterable': source.label}
+            for name in ('first_row', 'fetch_time', 'filter_time'):
+                value = getattr(source, name)
+                if value is not None:
+                    result.append(('{}_source_{}_seconds'.format(
+                        prefix, name.replace('_time', ''),
+                    ), value, labels))
+            for name in ('rows_fetched', 'rows_filtered', 'queries'):
+                result.append(('{}_source_{}'.format(prefix, name),
+                               getattr(source, name), labels))
+        return result
@@ -28,10 +28,27 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import sys
+
+import six
 from django.conf import settings
-from django.test import TestCase
+from django.core.paginator import EmptyPage
+from django.db.models.query import QuerySet
+from django.test import TestCase, TransactionTestCase
 from django.utils.unittest import skipUnless
 
+try:
+    from concurrent import futures
+except ImportError:
+    # Python 2 without the ``futures`` backport
+    futures = None
+
+if sys.version_info >= (3, 6):
+    # async generators are a syntax error on older Pythons
+    from dj.chain.aio_tests import AsyncMediaTests
+else:
+    AsyncMediaTests = object
+
 
 class SimpleTest(TestCase):
     def test_dummy(self):
@@ -165,6 +182,181 @@ class SimpleTest(TestCase):
         c2 = c.copy(*c.iterables)
         self.test_chain_sorted(c2)
 
+    def test_chain_copy_shares_plan(self):
+        from dj.chain import chain
+        c = chain((1, 2), [3, 4], "56")
+        c2 = c.copy()
+        self.assertIs(c._plan, c2._plan)
+        c3 = c[1:]
+        self.assertIs(c.iterables, c3.iterables)
+        self.assertEqual((None, None, None), (c.start, c.stop, c.step))
+        c2.xsort += ('real',)
+        self.assertEqual((), c.xsort)
+        self.assertEqual(('real',), c2.xsort)
+
+    def test_chain_sliced_len(self):
+        from dj.chain import chain
+
+        class huge(object):
+            def __len__(self):
+                return 10 ** 6
+
+            def __iter__(self):
+                raise AssertionError("len() should not iterate")
+
+        c = chain(huge(), (1, 2), [])
+        self.assertEqual(10 ** 6 + 2, len(c))
+        self.assertEqual(100, len(c[100:200]))
+        self.assertEqual(50, len(c[100:200:2]))
+        self.assertEqual(2, len(c[10 ** 6:]))
+        self.assertEqual(0, len(c[2 * 10 ** 6:]))
+        self.assertEqual(0, len(chain()))
+        self.assertEqual(0, len(chain([])[1:]))
+
+    @skipUnless(futures, "Requires concurrent.futures.")
+    def test_chain_parallel_xform(self):
+        from dj.chain import chain
+        seen = []
+
+        def xform(v):
+            seen.append(v)
+            return v * 10
+
+        c = chain(range(50), [50, 51], range(52, 100))
+        c.xform = xform
+        c.xfilter = lambda v: v % 3
+        expected = [v * 10 for v in range(100) if v % 3]
+        for workers, batch, prefetch in ((1, 1, 1), (4, 7, None), (2, 100, 3)):
+            p = c.parallel_xform(workers=workers, batch=batch,
+                                 prefetch=prefetch)
+            self.assertEqual(expected, list(p))
+            self.assertEqual(expected[5:20:3], list(p[5:20:3]))
+            self.assertEqual(expected[4], p[4])
+        del seen[:]
+        list(c.parallel_xform(batch=2)[10:14])
+        self.assertEqual(sorted(seen), [v for v in range(100) if v % 3][10:14])
+        p = chain(["1", "2"], "345").parallel_xform('process', workers=2,
+                                                    batch=2)
+        p.xform = int
+        self.assertEqual([1, 2, 3, 4, 5], list(p))
+        with self.assertRaises(ValueError):
+            c.parallel_xform('fork')
+        with self.assertRaises(ValueError):
+            c.parallel_xform(batch=0)
+
+    def test_chain_batch_hooks(self):
+        from dj.chain import chain
+        batches = []
+
+        def xfilter_batch(values):
+            batches.append(len(values))
+            return [int(v) % 2 == 0 for v in values]
+
+        c = chain((1, 2), [3, 4], "56")
+        c.xbatch_size = 2
+        c.xfilter_batch = xfilter_batch
+        c.xform_batch = lambda values: [int(v) for v in values]
+        self.assertEqual((2, 4, 6), tuple(c))
+        self.assertEqual(3, len(c))
+        self.assertEqual((4, 6), tuple(c[1:]))
+        self.assertEqual(2, len(c[1:3]))
+        self.assertEqual((2, 6), tuple(c[::2]))
+        self.assertEqual(6, c[2])
+        self.assertTrue(batches)
+        self.assertTrue(all(size <= 2 for size in batches))
+        c.xkey = lambda v: -int(v)
+        c.xfilter_batch = lambda values: [True] * len(values)
+        self.assertEqual([5, 6, 3, 4, 1, 2], list(c))
+        c.xform_batch = lambda values: [int(v) * 10 for v in values]
+        if futures is not None:
+            self.assertEqual([50, 60, 30],
+                             list(c.parallel_xform(batch=2)[:3]))
+
+    def test_chain_spooled_generators(self):
+        from dj.chain import chain
+        pulled = []
+
+        def numbers(count):
+            for i in range(count):
+                pulled.append(i)
+                yield i
+
+        c = chain(numbers(3), [3, 4], numbers(5), spool_threshold=2)
+        self.assertEqual(10, len(c))
+        spools = [c.iterables[0], c.iterables[2]]
+        # values past the threshold are spilled to disk
+        self.assertEqual([2, 2], [len(spool.memory) for spool in spools])
+        self.assertEqual([1, 3], [spool.spilled for spool in spools])
+        self.assertIsNotNone(spools[1].file)
+        self.assertEqual([0, 1, 2, 3, 4, 0, 1, 2, 3, 4], list(c))
+        self.assertEqual([0, 1, 2, 3, 4, 0, 1, 2, 3, 4], list(c))
+        self.assertEqual(3, c[8])
+        self.assertEqual(8, len(pulled))
+        spilled = chain(numbers(10), spool_threshold=3)
+        self.assertEqual(list(zip(range(10), range(10))),
+                         list(zip(spilled, spilled)))
+        self.assertEqual(7, spilled.iterables[0].spilled)
+        self.assertEqual(list(range(10)), list(spilled))
+        self.assertEqual(list(range(10)), list(spilled.copy()))
+        c = chain(numbers(100), spool_threshold=10)
+        c = c.copy(*c.iterables)
+        self.assertEqual([0, 1], list(c[:2]))
+        self.assertEqual(list(zip(range(50), range(50))),
+                         list(zip(c[:50], c[:50])))
+        self.assertEqual(100, c.count())
+        self.assertEqual(list(range(100)), list(c))
+        # a single pass stores nothing past the threshold
+        once = chain(numbers(10), spool_threshold=3)
+        self.assertEqual(list(range(10)), [v for v in once])
+        self.assertEqual((3, None), (len(once.iterables[0].memory),
+                                     once.iterables[0].file))
+        with self.assertRaises(ValueError):
+            [v for v in once]
+        with self.assertRaises(ValueError):
+            len(once)
+        # values which can't be pickled are kept in memory
+        lambdas = chain((lambda: i for i in range(5)), spool_threshold=2)
+        self.assertEqual(5, len(lambdas))
+        self.assertEqual(3, len(lambdas.iterables[0].overflow))
+        self.assertEqual(5, len([f() for f in lambdas]))
+
+    def test_chain_top_n(self):
+        from collections import namedtuple
+        from dj.chain import chain
+        Item = namedtuple('Item', 'size color')
+        c = chain(
+            [Item(5, 'red'), Item(1, 'red'), Item(9, 'red'), Item(3, 'red')],
+            (Item(8, 'blue'), Item(2, 'blue'), Item(7, 'blue')),
+            [Item(4, 'green'), Item(6, 'green')],
+        ).order_by('size')
+        self.assertEqual([1, 2, 3, 4, 5], [i.size for i in c[:5]])
+        self.assertEqual([3, 4], [i.size for i in c[2:4]])
+        self.assertEqual([3, 5], [i.size for i in c[2:6:2]])
+        self.assertEqual(
+            [9, 8, 7],
+            [i.size for i in chain(*c.iterables).order_by('-size')[:3]],
+        )
+        self.assertEqual(
+            [7, 2, 6, 4],
+            [i.size for i in chain(*c.iterables).order_by('color',
+                                                          '-size')[1:5]],
+        )
+        # lists longer than the slice, the smallest values at their ends
+        long_lists = chain(
+            [Item(5, 'red'), Item(9, 'red'), Item(1, 'red')],
+            [Item(8, 'blue'), Item(7, 'blue'), Item(2, 'blue')],
+        ).order_by('size')
+        self.assertEqual([1], [i.size for i in long_lists[:1]])
+        self.assertEqual([1, 2], [i.size for i in long_lists[:2]])
+        self.assertEqual([2, 5], [i.size for i in long_lists[1:3]])
+        c.xfilter = lambda i: i.size % 2
+        self.assertEqual([1, 3, 5], [i.size for i in c[:3]])
+        c.top_n_threshold = 2
+        # above the threshold iterables need to be presorted
+        self.assertNotIn('selected with a heap', c[:3].explain())
+        presorted = c.copy(*[sorted(it) for it in c.iterables])
+        self.assertEqual([1, 3, 5], [i.size for i in presorted[:3]])
+
     def test_chain_sorted_django_factory(self):
         from dj.chain import chain
         c = chain(("8", 1, 2, "8"), [8, 3, 4, 8], "8568")
@@ -174,10 +366,26 @@ class SimpleTest(TestCase):
         c2 = c._django_factory("__getitem__", slice(1, 3))
         self.test_chain_sorted(c2)
 
+    def test_import_without_django(self):
+        from dj.chain import bench
+        bench.python(bench.IMPORT_CHECK.format(modules=('django',)))
+
+    def test_bench(self):
+        from dj.chain import bench
+        out = six.StringIO()
+        results = bench.run(size=200, repeat=1, out=out)
+        self.assertEqual(len(bench.BENCHMARKS), len(results))
+        baseline = dict((name, {'rows_per_second': 1e12})
+                        for name in results)
+        comparison = bench.compare(results, baseline, tolerance=0.2)
+        self.assertTrue(all(regressed for _, _, _, regressed in comparison))
+        bench.report(comparison, out=out)
+        self.assertIn('REGRESSION', out.getvalue())
+
 
 @skipUnless("dj._chaintestproject.app" in settings.INSTALLED_APPS,
             "Requires the dj._chaintestproject.app to be installed.")
-class MediaTest(TestCase):
+class MediaTest(TestCase, AsyncMediaTests):
     def setUp(self):
         from dj._chaintestproject.app.models import Video, Song
         v1 = Video(
@@ -318,9 +526,14 @@ class MediaTest(TestCase):
         self.assertEqual(title_asc[3].title, 'Don Quixote')
         self.assertEqual(title_asc[4].title, 'Gangnam Style')
         self.assertEqual(title_asc[5].title, 'Waka Waka')
-        # No descending test since it would have rendered incorrect results
-        # anyway: non-queryset iterables have to be presorted for the result
-        # to be correctly ordered.
+        # Without slicing, non-queryset iterables have to be presorted for
+        # the result to be correctly ordered. With a small enough upper bound
+        # of the slice, the top of each of them is found with a heap.
+        title_desc = media.order_by('-title')[:4]
+        self.assertEqual(
+            ['Waka Waka', 'Gangnam Style', 'Don Quixote', 'Bad Romance'],
+            [m.title for m in title_desc],
+        )
 
     def test_strict_chain(self):
         from dj.chain import chain
@@ -345,6 +558,538 @@ class MediaTest(TestCase):
         self.assertEqual(strict_media_extra[4].title, 'A Tale of Two Cities')
         self.assertEqual(strict_media_extra[5].title, 'Don Quixote')
 
+    def test_explain(self):
+        from dj.chain import chain
+        media = chain(self.Video.objects.all(), self.books)
+        media = media.filter(duration__gt=250).order_by('title')[1:3]
+        media = media.values('title')
+        explanation = media.explain()
+        # ValuesQuerySet before Django 1.9
+        queryset = type(self.Video.objects.values('title')).__name__
+        self.assertIn('[0] {}(app.Video)'.format(queryset), explanation)
+        self.assertIn("pushed down: filter(duration__gt=250), order_by(",
+                      explanation)
+        self.assertIn('SQL: SELECT', explanation)
+        self.assertIn('[1] tuple', explanation)
+        self.assertIn("ignored: filter(duration__gt=250)", explanation)
+        self.assertIn("python: merge by order_by('title',) and xkey, "
+                      "at most 3 values per iterable, top 3 of iterables "
+                      "other than QuerySets selected with a heap, "
+                      "slice [1:3:], xvalue dict('title',)", explanation)
+
+    def test_chain_prefetch_related(self):
+        from dj.chain import chain
+        from dj._chaintestproject.app.models import Review
+        for video in self.Video.objects.all():
+            Review(video=video, text='Meh').save()
+        for song in self.Song.objects.all():
+            Review(song=song, text='Wow').save()
+
+        def media():
+            return chain(
+                self.Video.objects.all(), self.books, self.Song.objects.all(),
+            ).order_by('title').prefetch_related('reviews')
+        with self.assertNumQueries(4):
+            # two sources, one prefetch per model
+            page = list(m for m in media()[2:5])
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                ['Meh', 'Wow'],
+                [r.text for m in page[:2] for r in m.reviews.all()],
+            )
+        small_batches = media()
+        small_batches.xbatch_size = 1
+        with self.assertNumQueries(4):
+            # two sources, one prefetch per yielded model instance
+            list(m for m in small_batches[2:5])
+        with self.assertNumQueries(2):
+            list(m for m in media().prefetch_related(None)[2:5])
+        unsliced = media()
+        unsliced.xbatch_size = 1
+        with self.assertNumQueries(4):
+            # two sources, one prefetch per QuerySet
+            everything = [m for m in unsliced]
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                ['Meh'] * 4 + ['Wow'] * 4,
+                sorted(r.text for m in everything
+                       if hasattr(m, 'reviews') for r in m.reviews.all()),
+            )
+
+    def test_paginator(self):
+        from dj._chaintestproject.app.bench import captured_queries
+        from dj.chain import chain
+        from dj.chain.paginator import ChainPaginator
+        media = chain(self.Video.objects.all(), self.Song.objects.all())
+        paginator = ChainPaginator(media, 3)
+        with self.assertNumQueries(2):
+            self.assertEqual(8, paginator.count)
+            self.assertEqual(3, paginator.num_pages)
+        with self.assertNumQueries(1):
+            page = paginator.page(3)
+            self.assertEqual(['Madness', 'Spectrum'],
+                             [m.title for m in page])
+        with self.assertNumQueries(2):
+            page = paginator.page(2)
+            self.assertEqual(['Waka Waka', 'Somebody That I Used to Know',
+                              'Clocks'], [m.title for m in page])
+        self.assertTrue(page.has_next())
+        self.assertEqual((4, 6), (page.start_index(), page.end_index()))
+        paginator = ChainPaginator(media[2:], 4)
+        self.assertEqual(6, paginator.count)
+        self.assertEqual(['Madness', 'Spectrum'],
+                         [m.title for m in paginator.page(2)])
+        ordered = ChainPaginator(media.order_by('duration'), 3)
+        self.assertEqual([244, 253, 279],
+                         [m.duration for m in ordered.page(2)])
+        no_count = ChainPaginator(media.order_by('duration'), 3,
+                                  exact_count=False)
+        with self.assertNumQueries(2):
+            page = no_count.page(3)
+            self.assertEqual([307, 308], [m.duration for m in page])
+        self.assertFalse(page.has_next())
+        self.assertIsNone(no_count.count)
+        self.assertEqual((7, 8), (page.start_index(), page.end_index()))
+        self.assertTrue(no_count.page(2).has_next())
+        with self.assertRaises(EmptyPage):
+            no_count.page(4)
+        unordered = ChainPaginator(media, 3, exact_count=False)
+        with captured_queries() as queries:
+            page = unordered.page(2)
+            self.assertEqual(['Waka Waka', 'Somebody That I Used to Know',
+                              'Clocks'], [m.title for m in page])
+        self.assertTrue(page.has_next())
+        # no iterable is read past the page
+        self.assertEqual(2, len(queries))
+        for query in queries:
+            self.assertIn('LIMIT 7', query['sql'])
+
+    def test_export(self):
+        import json
+        from dj.chain import chain
+        media = chain(self.Video.objects.all(), self.books)
+        output = six.StringIO()
+        with self.assertNumQueries(1):
+            self.assertEqual(6, media.export(output, ('title', 'author')))
+        self.assertEqual([
+            'title,author', 'Gangnam Style,Psy', 'Baby,Justin Bieber',
+            'Bad Romance,Lady Gaga', 'Waka Waka,Shakira',
+            'A Tale of Two Cities,Charles Dickens',
+            'Don Quixote,Miguel de Cervantes',
+        ], output.getvalue().splitlines())
+        ordered = media.order_by('title')[:3]
+        ordered.xbatch_size = 1
+        chunks = list(ordered.export_chunks(('title',), format='jsonl',
+                                            buffer_size=1))
+        self.assertEqual(3, len(chunks))
+        self.assertEqual(
+            ['A Tale of Two Cities', 'Baby', 'Bad Romance'],
+            [json.loads(chunk)['title'] for chunk in chunks],
+        )
+        # ordered exports don't fill result caches either
+        ordered = chain(self.Video.objects.all(), self.Song.objects.all())
+        ordered = ordered.order_by('-duration')
+        ordered.stream_querysets = True
+        self.assertIn('QuerySets read with iterator()', ordered.explain())
+        self.assertEqual(
+            ['Bad Romance', 'Clocks', 'Madness'],
+            [v.title for v in ordered[:3]],
+        )
+        self.assertEqual(8, len([v.title for v in ordered]))
+        self.assertEqual([None, None],
+                         [it._result_cache for it in ordered.iterables])
+        output = six.StringIO()
+        self.assertEqual(8, ordered.filter(duration__gt=0).export(
+            output, ('title', 'duration'), header=False,
+        ))
+        self.assertEqual('Bad Romance,308',
+                         output.getvalue().splitlines()[0])
+        self.assertEqual(['title\r\n'], list(media.none().export_chunks(
+            ('title',),
+        )))
+        with self.assertRaises(ValueError):
+            media.export(output, ('title',), format='xml')
+
+    def test_approximate_count(self):
+        from django.db import connection, transaction
+        from dj.chain import chain
+        from dj.chain.estimate import estimated_count
+        media = chain(self.Video.objects.all(), self.books)
+        self.assertEqual(6, media.count(approximate=True))
+        if connection.vendor != 'sqlite':
+            return
+        atomic = getattr(transaction, 'atomic', None)
+        if atomic is None:
+            # Django < 1.6: the estimate runs in a savepoint of the test's
+            # transaction, which ANALYZE below would commit
+            self.assertIsNone(estimated_count(self.Video.objects.all()))
+            self.assertEqual(4, self.Video.objects.count())
+            return
+        with atomic():
+            # sqlite_stat1 doesn't exist before ANALYZE
+            self.assertIsNone(estimated_count(self.Video.objects.all()))
+            self.assertFalse(connection.needs_rollback)
+            self.assertEqual(4, self.Video.objects.count())
+        cursor = connection.cursor()
+        cursor.execute('ANALYZE')
+        cursor.execute("UPDATE sqlite_stat1 SET stat = '5000' "
+                       "WHERE tbl = 'app_video'")
+        self.assertEqual(5000, estimated_count(self.Video.objects.all()))
+        self.assertIsNone(estimated_count(
+            self.Video.objects.filter(duration__gt=250),
+        ))
+        self.assertEqual(6, media.count())
+        self.assertEqual(5002, media.count(approximate=True))
+        self.assertEqual(100, media[100:200].count(approximate=True))
+        self.assertEqual(
+            4, media.filter(duration__gt=250).count(approximate=True),
+        )
+        media.approximate_threshold = 10000
+        self.assertEqual(6, media.count(approximate=True))
+
+    def test_update_and_delete(self):
+        from dj.chain import chain
+        media = chain(self.Video.objects.all(), self.Song.objects.all())
+        long_media = media.filter(duration__gt=250)
+        self.assertEqual(4, long_media.update(title='Long'))
+        self.assertEqual(4, media.filter(title='Long').count())
+        with self.assertRaises(TypeError):
+            chain(self.Video.objects.all(), self.books).update(title='Long')
+        with self.assertRaises(TypeError):
+            media[1:].update(title='Long')
+        updated = []
+        with_books = chain(self.Video.objects.all(), self.books)
+        with_books.xupdate = lambda value, **kwargs: updated.append(
+            value._replace(**kwargs),
+        )
+        self.assertEqual(6, with_books.update(title='Short'))
+        self.assertEqual(['Short', 'Short'], [b.title for b in updated])
+        self.assertEqual(
+            (2, {'app.Video': 1, 'app.Song': 1}),
+            media.filter(duration__gt=300).delete(),
+        )
+        self.assertEqual(6, media.count())
+        deleted = []
+        with_books.xdelete = deleted.append
+        self.assertEqual((5, {'app.Video': 3, 'Book': 2}), with_books.delete())
+        self.assertEqual(list(self.books), deleted)
+
+    def test_declared_bounds(self):
+        from django.db.models import Max, Sum
+        from dj._chaintestproject.app.bench import captured_queries
+        from dj.chain import chain
+        short = chain.source(self.Video.objects.filter(duration__lt=240),
+                             bounds={'duration': (200, 239)})
+        long = chain.source(self.Video.objects.filter(duration__gte=240),
+                            bounds={'duration': (240, None)})
+        media = chain(long, short)
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                ['Gangnam Style', 'Bad Romance'],
+                [v.title for v in media.filter(duration__gt=250)],
+            )
+        self.assertIn('pruned by declared bounds',
+                      media.filter(duration__in=[211, 225]).explain())
+        self.assertEqual(0, media.filter(duration__lt=100).count())
+        by_duration = chain(long, short).order_by('duration')
+        self.assertIn('concatenate by declared bounds of duration',
+                      by_duration.explain())
+        with captured_queries() as queries:
+            self.assertEqual([211, 225],
+                             [v.duration for v in by_duration[:2]])
+        self.assertEqual(1, len(queries))
+        self.assertEqual(
+            [308, 253, 225, 211],
+            [v.duration for v in chain(short, long).order_by('-duration')],
+        )
+        overlapping = chain(long, chain.source(self.Song.objects.all(), {
+            'duration': (200, 400),
+        })).order_by('duration')
+        self.assertNotIn('concatenate', overlapping.explain())
+        self.assertEqual(
+            min(s.duration for s in self.Song.objects.all()),
+            overlapping[0].duration,
+        )
+        # pruned iterables have nothing to aggregate, update or delete
+        long_media = media.filter(duration__gt=250)
+        self.assertEqual({'duration__max': 308},
+                         long_media.aggregate(Max('duration')))
+        self.assertEqual(
+            {'total': None},
+            media.filter(duration__lt=100).aggregate(total=Sum('duration')),
+        )
+        self.assertEqual(2, long_media.update(title='Long'))
+        self.assertEqual((2, {'app.Video': 2}), long_media.delete())
+        self.assertEqual(2, media.count())
+
+    def test_deep_offset(self):
+        from dj.chain import chain
+        self.Video(author='Various', title='Apple', duration=244,
+                   resolution=1).save()
+        self.Video(author='Various', title='Zebra', duration=244,
+                   resolution=1).save()
+        media = chain(self.Video.objects.all(), self.Song.objects.all())
+        values = list(self.Video.objects.all()) + list(self.Song.objects.all())
+        for rules in (('duration', 'title'), ('-duration', 'title')):
+            expected = sorted(values, key=lambda v: v.title)
+            expected.sort(key=lambda v: v.duration,
+                          reverse=rules[0].startswith('-'))
+            by_duration = media.order_by(*rules)
+            by_duration.deep_offset_threshold = 1
+            self.assertIn('seek to offset 3', by_duration[3:].explain())
+            for start in range(1, len(values) + 1):
+                self.assertEqual(
+                    [v.title for v in expected[start:start + 2]],
+                    [v.title for v in by_duration[start:start + 2]],
+                )
+            self.assertEqual(
+                [v.title for v in expected[2::3]],
+                [v.title for v in by_duration[2::3]],
+            )
+        self.assertNotIn('seek', media.order_by('duration')[3:].explain())
+        by_title = chain(self.Video.objects.all(), self.books).order_by(
+            'title',
+        )
+        by_title.deep_offset_threshold = 1
+        self.assertNotIn('seek', by_title[3:].explain())
+
+    def test_fetch_window(self):
+        from dj._chaintestproject.app.bench import captured_queries
+        from dj.chain import chain
+        for title in ('Apple', 'Zebra', 'Mango'):
+            self.Video(author='Various', title=title, duration=244,
+                       resolution=1).save()
+        media = chain(self.Video.objects.all(), self.Song.objects.all())
+        # opt-in
+        self.assertNotIn('keyset', media.order_by('duration').explain())
+        for rules in (('duration',), ('-duration', 'title')):
+            ordered = media.order_by(*rules)
+            ordered.fetch_window = 2
+            self.assertIn('keyset windows of 2, 8, ... rows from iterables '
+                          '0, 1', ordered.explain())
+            unwindowed = media.order_by(*rules)
+            self.assertNotIn('keyset', unwindowed.explain())
+            self.assertEqual([(type(v), v.pk) for v in unwindowed],
+                             [(type(v), v.pk) for v in ordered])
+            with captured_queries() as queries:
+                iterator = iter(ordered)
+                for _ in range(3):
+                    next(iterator)
+            # the first window of every QuerySet
+            self.assertEqual(len(queries), 2)
+            self.assertIn('LIMIT 2', queries[0]['sql'])
+        media.fetch_window = 2
+        self.assertNotIn('keyset', media.order_by('duration')[:5].explain())
+        # NULLs don't compare
+        self.assertNotIn('keyset', media.order_by('released').explain())
+
+    @skipUnless(hasattr(QuerySet, 'union'),
+                "Requires QuerySet.union(), Django 1.11+.")
+    def test_coalesced_querysets(self):
+        from django.db import connection
+        from dj._chaintestproject.app.bench import captured_queries
+        from dj.chain import chain
+        media = chain(
+            self.Video.objects.filter(duration__lt=240),
+            self.Video.objects.filter(resolution__gte=4),
+            self.Song.objects.all(),
+            self.Video.objects.filter(resolution=2),
+        )
+        separate = media.copy()
+        separate.coalesce_querysets = False
+        self.assertIn('UNION ALL of iterables 0, 1', media.explain())
+        with captured_queries() as queries:
+            titles = [v.title for v in media]
+        self.assertEqual(3, len(queries))
+        # Baby matches both QuerySets
+        self.assertEqual([v.title for v in separate], titles)
+        self.assertEqual(2, titles.count('Baby'))
+        for rules in (('duration',), ('-duration', 'title')):
+            explanation = media.order_by(*rules).explain()
+            self.assertIn('UNION ALL of iterables 0, 1', explanation)
+            # ties across groups are broken by position in the chain
+            self.assertNotIn('UNION ALL of iterables 0, 1, 3', explanation)
+            with captured_queries() as queries:
+                titles = [v.title for v in media.order_by(*rules)[1:6]]
+            self.assertEqual(3, len(queries))
+            self.assertEqual(
+                [v.title for v in separate.order_by(*rules)[1:6]], titles,
+            )
+        self.assertNotIn('UNION', media.order_by('pk').explain())
+        self.Video(author='Various', title='Apple', duration=999,
+                   resolution=5).save()
+        self.Video(author='Various', title='Zebra', duration=999,
+                   resolution=1).save()
+        longest = chain(
+            self.Video.objects.filter(resolution=1),
+            self.Video.objects.filter(resolution=5),
+        ).order_by('-duration')
+        self.assertIn('UNION ALL', longest.explain())
+        self.assertEqual(['Zebra', 'Apple'],
+                         [v.title for v in longest[:2]])
+        if connection.vendor == 'sqlite':
+            many = chain(*[self.Video.objects.filter(duration__gt=i)
+                           for i in range(600)])
+            self.assertEqual([list(range(500)), list(range(500, 600))],
+                             many._coalescible(many.iterables))
+            total = many.count()
+            with captured_queries() as queries:
+                self.assertEqual(total, sum(1 for _ in many))
+            self.assertEqual(2, len(queries))
+        self.assertNotIn('UNION', chain(
+            self.Video.objects.all(), self.books, self.Video.objects.all(),
+        ).explain())
+
+    def test_dates(self):
+        import datetime
+        from dj.chain import chain
+        self.Video.objects.filter(title='Baby').update(
+            released=datetime.date(2010, 1, 18),
+        )
+        self.Video.objects.filter(title='Gangnam Style').update(
+            released=datetime.date(2012, 7, 15),
+        )
+        self.Song.objects.filter(duration__gt=240).update(
+            released=datetime.date(2012, 7, 2),
+        )
+        events = [
+            {'title': 'Premiere', 'released': datetime.datetime(
+                2011, 3, 9, 20, 30)},
+            {'title': 'Unknown', 'released': None},
+        ]
+        media = chain(self.Video.objects.all(), self.Song.objects.all(),
+                      events)
+        with self.assertNumQueries(2):
+            self.assertEqual(
+                [datetime.date(2010, 1, 1), datetime.date(2011, 3, 1),
+                 datetime.date(2012, 7, 1)],
+                media.dates('released', 'month'),
+            )
+        self.assertEqual(
+            [datetime.date(2012, 1, 1), datetime.date(2011, 1, 1),
+             datetime.date(2010, 1, 1)],
+            media.dates('released', 'year', order='DESC'),
+        )
+        self.assertEqual(
+            [datetime.date(2010, 1, 18), datetime.date(2011, 3, 7),
+             datetime.date(2012, 7, 2), datetime.date(2012, 7, 9)],
+            media.dates('released', 'week'),
+        )
+        self.assertEqual(
+            [datetime.date(2010, 1, 18)],
+            chain(*media.iterables[:2]).filter(duration=225).dates(
+                'released', 'day',
+            ),
+        )
+        # dates, not datetimes, on every Django version
+        self.assertEqual(
+            [datetime.date], list(set(
+                type(d) for d in chain(*media.iterables[:2]).dates(
+                    'released', 'month',
+                )
+            )),
+        )
+        self.assertEqual(
+            [datetime.datetime(2011, 3, 9, 20, 0)],
+            chain(events).datetimes('released', 'hour'),
+        )
+        self.assertEqual(
+            [datetime.datetime(2011, 3, 9)],
+            chain(events).datetimes('released', 'day'),
+        )
+        self.assertRaises(ValueError, media.dates, 'released', 'hour')
+        self.assertRaises(ValueError, media.dates, 'released', 'day', 'UP')
+
+    def test_datetimes_with_time_zones(self):
+        import datetime
+        from django.test.utils import override_settings
+        from django.utils import timezone
+        from dj.chain import chain
+        utc = timezone.utc if hasattr(timezone, 'utc') else None
+        with override_settings(USE_TZ=True, TIME_ZONE='Europe/Warsaw'):
+            warsaw = timezone.get_current_timezone()
+            self.Video.objects.filter(title='Baby').update(
+                uploaded=datetime.datetime(2012, 7, 14, 23, 30, tzinfo=utc),
+            )
+            events = [
+                # 00:30 in Warsaw
+                {'uploaded': datetime.datetime(2011, 3, 9, 23, 30,
+                                               tzinfo=utc)},
+                # naive values are in the default time zone
+                {'uploaded': datetime.datetime(2011, 3, 9, 20, 30)},
+                {'uploaded': datetime.date(2010, 1, 18)},
+            ]
+            media = chain(self.Video.objects.all(), events)
+            self.assertEqual(
+                [timezone.make_aware(datetime.datetime(*day), warsaw)
+                 for day in ((2010, 1, 18), (2011, 3, 9), (2011, 3, 10),
+                             (2012, 7, 15))],
+                media.datetimes('uploaded', 'day'),
+            )
+            days = media.datetimes('uploaded', 'day', tzinfo=utc)
+            self.assertEqual(
+                [datetime.datetime(*day, tzinfo=utc)
+                 for day in ((2010, 1, 18), (2011, 3, 9), (2012, 7, 14))],
+                days,
+            )
+            self.assertEqual(
+                [datetime.date(2011, 3, 9), datetime.date(2011, 3, 10)],
+                chain(events[:2]).dates('uploaded', 'day'),
+            )
+
+    def test_get(self):
+        from django.core.exceptions import (
+            MultipleObjectsReturned, ObjectDoesNotExist,
+        )
+        from dj.chain import chain
+        media = chain(self.Video.objects.all(), self.Song.objects.all())
+        self.assertEqual('Baby', media.get(duration=225).title)
+        self.assertRaises(ObjectDoesNotExist, media.get, duration=1)
+        self.assertRaises(MultipleObjectsReturned, media.get)
+
+    def test_instrumented(self):
+        from django.db import connection
+        from dj.chain import chain
+        # queries are only counted with execute_wrapper, Django 2.0+
+        queries = hasattr(connection, 'execute_wrapper')
+        media = chain(self.Video.objects.all(), self.books).instrumented()
+        media.xfilter = lambda v: v.title != 'Baby'
+        media.xform = lambda v: v.title
+        self.assertIsNone(chain().stats)
+        self.assertIn('record stats', media.explain())
+        self.assertEqual(
+            ['Gangnam Style', 'Bad Romance', 'Waka Waka'],
+            [title for title in media[:3]],
+        )
+        stats = media.stats
+        video, = stats.sources
+        self.assertEqual('QuerySet(app.Video)', video.label)
+        self.assertEqual(4, video.rows_fetched)
+        self.assertEqual(1, video.rows_filtered)
+        if queries:
+            self.assertEqual(1, video.queries)
+        self.assertIsNotNone(video.first_row)
+        self.assertTrue(video.fetch_time >= video.first_row)
+        self.assertEqual(0, stats.rows_skipped)
+        self.assertEqual(3, stats.rows_yielded)
+        self.assertEqual(
+            ['Bad Romance', 'Don Quixote'],
+            [title for title in media.order_by('title')[1:3]],
+        )
+        self.assertEqual(1, stats.rows_skipped)
+        books = stats.sources[1]
+        self.assertEqual(2, books.rows_fetched)
+        self.assertEqual(0, books.queries)
+        self.assertEqual(5, stats.rows_yielded)
+        metrics = dict(((name, labels.get('source')), value)
+                       for name, value, labels in stats.metrics())
+        self.assertEqual(5, metrics['dj_chain_rows_yielded', None])
+        if queries:
+            self.assertEqual(2, video.queries)
+            self.assertEqual(2, metrics['dj_chain_source_queries', '0'])
+        self.assertIn(('dj_chain_xform_seconds', None), metrics)
+        self.assertIn(('dj_chain_source_first_row_seconds', '1'), metrics)
+
     def test_xvalues(self):
         from dj.chain import chain
         media = chain(self.Video.objects.all(), self.books)
@@ -376,3 +1121,148 @@ class MediaTest(TestCase):
         self.assertEqual(media_values_list2[4], 'Charles Dickens')
         self.assertEqual(media_values_list2[5], 'Miguel de Cervantes')
 
+
+@skipUnless("dj._chaintestproject.app" in settings.INSTALLED_APPS,
+            "Requires the dj._chaintestproject.app to be installed.")
+class BenchmarkTest(TestCase):
+    def setUp(self):
+        from dj._chaintestproject.app import bench
+        bench.populate(500)
+        self.bench = bench
+
+    def test_query_budgets(self):
+        results = self.bench.run()
+        self.assertEqual([name for name, _ in self.bench.OPERATIONS],
+                         [name for name, _, _ in results])
+        for name, stats, over_budget in results:
+            self.assertFalse(over_budget, "{} issued {} queries".format(
+                name, stats['queries'],
+            ))
+        stats = dict((name, stats) for name, stats, _ in results)
+        self.assertEqual(10, stats['top-n']['yielded'])
+        self.assertEqual(1000, stats['export']['yielded'])
+        if stats['top-n']['fetched'] is None:
+            # rows are only counted on Django 2.0+
+            return
+        # LIMIT is pushed down to both QuerySets
+        self.assertEqual(20, stats['top-n']['fetched'])
+        # counts plus a window of a single page
+        self.assertEqual(22, stats['page']['fetched'])
+
+
+@skipUnless({'shard1', 'shard2'} <= set(settings.DATABASES),
+            "Requires the shard1 and shard2 databases to be configured.")
+class ShardTest(TransactionTestCase):
+    multi_db = True
+    databases = {'default', 'shard1', 'shard2'}
+
+    def setUp(self):
+        from dj._chaintestproject.app.models import Video
+        for alias, durations in (('shard1', (253, 211)),
+                                 ('shard2', (225, 308, 218))):
+            for duration in durations:
+                Video(
+                    author='Psy', title='Video', duration=duration,
+                    resolution=1,
+                ).save(using=alias)
+        self.Video = Video
+
+    @skipUnless(futures, "Requires concurrent.futures.")
+    def test_sharded(self):
+        from dj.chain import chain
+        from django.db.models import Avg, Count, Max, Min, Sum
+        videos = chain.sharded(self.Video.objects.all(), ['shard1', 'shard2'])
+        self.assertEqual(2, videos.xthreads)
+        self.assertEqual(5, videos.count())
+        self.assertEqual([253, 211, 225, 308, 218],
+                         [v.duration for v in videos])
+        self.assertEqual([211, 218, 225],
+                         [v.duration for v in videos.order_by('duration')[:3]])
+        self.assertEqual([308, 253],
+                         [v.duration for v in videos.filter(
+                             duration__gt=250).order_by('-duration')])
+        self.assertEqual(
+            {'duration__sum': 1215, 'duration__min': 211,
+             'duration__max': 308, 'count': 5, 'avg': 243},
+            videos.aggregate(Sum('duration'), Min('duration'),
+                             Max('duration'), count=Count('id'),
+                             avg=Avg('duration')),
+        )
+        self.assertIn('evaluated concurrently by 2 threads', videos.explain())
+        with self.assertRaises(TypeError):
+            chain(self.Video.objects.using('shard1'), []).aggregate(
+                Sum('duration'),
+            )
+
+    @skipUnless(futures, "Requires concurrent.futures.")
+    def test_streamed(self):
+        import threading
+        from django.db import DatabaseError
+        from dj.chain import chain
+        videos = chain.sharded(self.Video.objects.all(), ['shard1', 'shard2'])
+        concurrent = videos.concurrent(1, queue_size=1)
+        concurrent.xbatch_size = 1
+        streamed = concurrent.order_by('duration')
+        self.assertIn('streaming into queues of 1 batches',
+                      streamed.explain())
+        self.assertNotIn('streaming', videos.concurrent(2).explain())
+        threads = threading.active_count()
+        self.assertEqual([211, 218, 225, 253, 308],
+                         [v.duration for v in streamed])
+        self.assertEqual([308, 253],
+                         [v.duration for v in concurrent.filter(
+                             duration__gt=250).order_by('-duration')])
+        self.assertEqual([218, 225],
+                         [v.duration for v in streamed[1:3]])
+        # producers stop when the consumer does, releasing their cursors
+        stderr = sys.stderr
+        sys.stderr = six.StringIO()
+        try:
+            iterator = iter(streamed)
+            self.assertEqual(211, next(iterator).duration)
+            iterator.close()
+            errors = sys.stderr.getvalue()
+        finally:
+            sys.stderr = stderr
+        self.assertNotIn('Exception ignored', errors)
+        self.assertEqual(threads, threading.active_count())
+        broken = chain(
+            self.Video.objects.using('shard1'),
+            self.Video.objects.using('shard2').extra(where=['nonsense > 0']),
+        ).concurrent(queue_size=2).order_by('duration')
+        with self.assertRaises(DatabaseError):
+            list(broken)
+        self.assertEqual(threads, threading.active_count())
+        with self.assertRaises(ValueError):
+            videos.concurrent(queue_size=0)
+
+    def test_streamed_fetches_lazily(self):
+        import threading
+        from collections import Counter
+        from django.db.models.signals import post_init
+        from dj.chain import chain
+        for shard in ('shard1', 'shard2'):
+            for duration in range(400, 420):
+                self.Video(author='Various', title='Filler',
+                           duration=duration,
+                           resolution=1).save(using=shard)
+        fetched = Counter()
+
+        def count(sender, **kwargs):
+            fetched[threading.current_thread().name] += 1
+
+        videos = chain.sharded(self.Video.objects.all(), ['shard1', 'shard2'])
+        streamed = videos.concurrent(2, queue_size=1).order_by('duration')
+        streamed.xbatch_size = 1
+        post_init.connect(count, sender=self.Video)
+        try:
+            iterator = iter(streamed)
+            self.assertEqual([211, 218, 225],
+                             [next(iterator).duration for _ in range(3)])
+            iterator.close()
+        finally:
+            post_init.disconnect(count, sender=self.Video)
+        # over 20 rows per shard, every producer stays a few rows ahead
+        self.assertEqual(2, len(fetched))
+        for rows in fetched.values():
+            self.assertLessEqual(rows, 6)